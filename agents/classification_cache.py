@@ -0,0 +1,72 @@
+"""Кэш результатов LLM классификации
+
+Ключ кэша - (content_hash статьи, хеш нормализованного критерия отбора,
+модель, temperature, версия промпта). В кэше хранится только оценка
+релевантности и причина: is_relevant пересчитывается по порогу текущего
+запроса. Результаты простой классификации по ключевым словам (fallback)
+в кэш не попадают.
+"""
+import hashlib
+import re
+
+from models import ClassificationCache
+from agents.db_utils import iter_chunks, insert_missing
+
+
+def normalize_criteria(criteria: str) -> str:
+    """Критерий отбора без различий в регистре и пробелах"""
+    return re.sub(r'\s+', ' ', (criteria or '').strip().lower())
+
+
+def get_criteria_hash(criteria: str) -> str:
+    """SHA-256 нормализованного критерия отбора"""
+    return hashlib.sha256(normalize_criteria(criteria).encode('utf-8')).hexdigest()
+
+
+def _cache_key_filter(query, criteria_hash: str, llm_model: str, llm_temperature: float, prompt_version: str):
+    return query.filter(
+        ClassificationCache.criteria_hash == criteria_hash,
+        ClassificationCache.llm_model == llm_model,
+        ClassificationCache.llm_temperature == float(llm_temperature),
+        ClassificationCache.prompt_version == prompt_version
+    )
+
+
+def load_cached_classifications(session, content_hashes: list, criteria: str, llm_model: str,
+                                llm_temperature: float, prompt_version: str) -> dict:
+    """Закэшированные результаты: {content_hash: (relevance_score, classification_reason)}"""
+    criteria_hash = get_criteria_hash(criteria)
+    content_hashes = list({content_hash for content_hash in content_hashes if content_hash})
+    cached = {}
+    for chunk in iter_chunks(content_hashes):
+        query = session.query(
+            ClassificationCache.content_hash, ClassificationCache.relevance_score, ClassificationCache.classification_reason
+        ).filter(ClassificationCache.content_hash.in_(chunk))
+        query = _cache_key_filter(query, criteria_hash, llm_model, llm_temperature, prompt_version)
+        for content_hash, relevance_score, reason in query:
+            cached[content_hash] = (relevance_score, reason)
+    return cached
+
+
+def store_classifications(session, results: dict, criteria: str, llm_model: str,
+                          llm_temperature: float, prompt_version: str):
+    """Сохранение результатов {content_hash: (relevance_score, classification_reason)} в кэш"""
+    criteria_hash = get_criteria_hash(criteria)
+    rows = [
+        {
+            'content_hash': content_hash,
+            'criteria_hash': criteria_hash,
+            'llm_model': llm_model,
+            'llm_temperature': float(llm_temperature),
+            'prompt_version': prompt_version,
+            'relevance_score': relevance_score,
+            'classification_reason': reason
+        }
+        for content_hash, (relevance_score, reason) in results.items()
+    ]
+    insert_missing(
+        session, ClassificationCache, rows, 'content_hash',
+        lambda content_hashes: load_cached_classifications(
+            session, content_hashes, criteria, llm_model, llm_temperature, prompt_version
+        )
+    )
@@ -3,46 +3,122 @@ from config import Config
 from models import NewsArticle, get_db_session
 from typing import List
 from agents.llm_utils import create_llm_with_settings
-import requests
-import json
+from agents.rate_limiter import post_with_rate_limit, chat_completions_url, estimate_tokens
+from agents.structured_output import json_chat_completion, langchain_json_completion, parse_json_value
+from agents.classification_cache import load_cached_classifications, store_classifications
+from agents.db_utils import update_by_id
+from agents.summarizer import prepare_summary_content, SUMMARY_MAX_TOKENS
+from agents.embeddings import (
+    generate_embeddings_for_articles_by_ids, generate_embedding_with_openai, load_embeddings,
+    normalize_embeddings, EMBEDDING_MODEL
+)
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+import string
+import re
 
+# Количество классифицированных статей, после которого результаты сохраняются в БД
+CLASSIFICATION_SAVE_EVERY = 20
+# Версия промптов классификации (часть ключа кэша; увеличивать при изменении промптов)
+CLASSIFICATION_PROMPT_VERSION = '2'
+# Версия промптов классификации с саммари (оценки другого промпта кэшируются отдельно)
+COMBINED_PROMPT_VERSION = '2-combined'
 
-def classify_with_direct_api(article: NewsArticle, criteria: str, llm_model: str = None, llm_temperature: float = None, relevance_threshold: float = None) -> dict:
-    """Классификация через прямой HTTP запрос к API"""
-    if llm_model is None:
-        llm_model = Config.LLM_MODEL
-    if llm_temperature is None:
-        llm_temperature = Config.LLM_TEMPERATURE
-    if relevance_threshold is None:
-        relevance_threshold = Config.RELEVANCE_THRESHOLD
+
+def _attach_summary(result: dict, item: dict) -> dict:
+    """Добавление саммари из ответа LLM к результату (только для релевантной статьи)"""
+    summary = item.get('summary')
+    if result['is_relevant'] and isinstance(summary, str) and summary.strip():
+        result['summary'] = summary.strip()
+    return result
+
+
+def _parse_single_response(content: str, relevance_threshold: float):
+    """Результат классификации из JSON объекта ответа LLM; None, если ответ не разобран
     
-    # Формируем URL для запроса
-    api_url = Config.OPENAI_API_BASE.rstrip('/')
-    if not api_url.endswith('/chat/completions'):
-        if api_url.endswith('/v1'):
-            api_url = f"{api_url}/chat/completions"
-        else:
-            api_url = f"{api_url}/v1/chat/completions"
+    is_relevant определяется порогом relevance_threshold, как и для результатов
+    из кэша, а не полем is_relevant ответа модели.
+    """
+    parsed = parse_json_value(content, '{')
+    if not isinstance(parsed, dict):
+        return None
+    try:
+        relevance_score = float(parsed.get('relevance_score', 0.0))
+        return _attach_summary({
+            'relevance_score': relevance_score,
+            'is_relevant': relevance_score >= relevance_threshold,
+            'reason': parsed.get('reason', '')
+        }, parsed)
+    except (TypeError, ValueError):
+        return None
+
+
+def _output_tokens(with_summary: bool) -> int:
+    """Ограничение длины ответа классификации одной статьи (с саммари - больше)"""
+    if with_summary:
+        return Config.CLASSIFICATION_MAX_TOKENS + SUMMARY_MAX_TOKENS
+    return Config.CLASSIFICATION_MAX_TOKENS
+
+
+def _prompt_version(with_summary: bool) -> str:
+    """Версия промпта для ключа кэша классификации"""
+    return COMBINED_PROMPT_VERSION if with_summary else CLASSIFICATION_PROMPT_VERSION
+
+
+def _prompt_content(article: NewsArticle, with_summary: bool) -> str:
+    """Текст статьи для промпта классификации (с саммари - без HTML, `CLASSIFICATION_COMBINED_CONTENT_LENGTH`)"""
+    if with_summary:
+        content = prepare_summary_content(article, Config.CLASSIFICATION_COMBINED_CONTENT_LENGTH)
+    else:
+        content = article.content[:500] if article.content else ''
+    return content or 'Нет содержания'
+
+
+def _summary_rule(relevance_threshold: float) -> str:
+    """Пояснение условного поля summary в промпте классификации"""
+    return (f"\n- summary: только если relevance_score >= {relevance_threshold} - краткое саммари новости "
+            "на русском языке (2-3 предложения, максимум 150 слов), передающее основную суть; иначе null")
+
+
+def _build_single_prompt(article: NewsArticle, criteria: str, relevance_threshold: float, with_summary: bool = False) -> str:
+    """Промпт для классификации одной статьи (with_summary - с условным саммари)"""
+    summary_field = ',\n    "summary": "<саммари или null>"' if with_summary else ''
+    summary_rule = _summary_rule(relevance_threshold) if with_summary else ''
     
-    prompt = f"""Проанализируй следующую новость и определи её релевантность к критерию отбора.
+    return f"""Проанализируй следующую новость и определи её релевантность к критерию отбора.
 
 Критерий отбора: {criteria}
 
 Заголовок: {article.title}
-Содержание: {article.content[:500] if article.content else 'Нет содержания'}
+Содержание: {_prompt_content(article, with_summary)}
 
 Ответь в формате JSON:
 {{
     "relevance_score": <число от 0.0 до 1.0>,
     "is_relevant": <true или false>,
-    "reason": "<краткое объяснение причины>"
+    "reason": "<краткое объяснение причины>"{summary_field}
 }}
 
 Где:
 - relevance_score: оценка релевантности (0.0 - не релевантно, 1.0 - полностью релевантно)
 - is_relevant: true если relevance_score >= {relevance_threshold}, иначе false
-- reason: краткое объяснение почему статья релевантна или нет
+- reason: краткое объяснение почему статья релевантна или нет{summary_rule}
 """
+
+
+def _direct_chat_completion(prompt: str, llm_model: str, llm_temperature: float, timeout: float = 30,
+                            output_tokens: int = None) -> str:
+    """Текст ответа chat completions через прямой HTTP запрос к OPENAI_API_BASE
+    
+    При LLM_STRUCTURED_OUTPUT = auto / on ответ запрашивается в JSON режиме
+    с ограничением output_tokens (`agents/structured_output.py`).
+    """
+    if output_tokens is None:
+        output_tokens = Config.CLASSIFICATION_MAX_TOKENS
+    if Config.LLM_STRUCTURED_OUTPUT != 'off':
+        return json_chat_completion(prompt, llm_model, llm_temperature, output_tokens, timeout)
+    
+    api_url = chat_completions_url()
     
     headers = {
         'Content-Type': 'application/json',
@@ -57,36 +133,34 @@ def classify_with_direct_api(article: NewsArticle, criteria: str, llm_model: str
         'temperature': llm_temperature
     }
     
-    response = requests.post(api_url, headers=headers, json=payload, timeout=30)
+    response = post_with_rate_limit(api_url, llm_model, estimate_tokens(prompt, output_tokens),
+                                    headers=headers, json=payload, timeout=timeout)
     response.raise_for_status()
     
     result = response.json()
-    content = result['choices'][0]['message']['content']
-    
-    # Парсинг JSON из ответа
-    import re
-    json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', content, re.DOTALL)
-    if not json_match:
-        json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', content, re.DOTALL)
-        if json_match:
-            json_match = json_match.group(1)
-        else:
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
+    return result['choices'][0]['message']['content']
+
+
+def classify_with_direct_api(article: NewsArticle, criteria: str, llm_model: str = None, llm_temperature: float = None, relevance_threshold: float = None, with_summary: bool = False) -> dict:
+    """Классификация через прямой HTTP запрос к API (with_summary - с саммари релевантной статьи в том же ответе)"""
+    if llm_model is None:
+        llm_model = Config.LLM_MODEL
+    if llm_temperature is None:
+        llm_temperature = Config.LLM_TEMPERATURE
+    if relevance_threshold is None:
+        relevance_threshold = Config.RELEVANCE_THRESHOLD
     
-    if json_match:
-        json_str = json_match.group() if hasattr(json_match, 'group') else json_match
-        try:
-            parsed = json.loads(json_str)
-            return {
-                'relevance_score': float(parsed.get('relevance_score', 0.0)),
-                'is_relevant': bool(parsed.get('is_relevant', False)),
-                'reason': parsed.get('reason', '')
-            }
-        except json.JSONDecodeError:
-            pass
+    prompt = _build_single_prompt(article, criteria, relevance_threshold, with_summary)
+
+    content = _direct_chat_completion(prompt, llm_model, llm_temperature, output_tokens=_output_tokens(with_summary))
+    
+    result = _parse_single_response(content, relevance_threshold)
+    if result is not None:
+        return result
     
     # Если не удалось распарсить, используем простую классификацию
-    return simple_classification(article, criteria)
+    print(f"JSON не найден в ответе для статьи {article.id}, используем простую классификацию")
+    return simple_classification(article, criteria, relevance_threshold)
 
 
 def classify_article_relevance(article: NewsArticle, criteria: str) -> dict:
@@ -94,8 +168,12 @@ def classify_article_relevance(article: NewsArticle, criteria: str) -> dict:
     return classify_article_relevance_with_settings(article, criteria, Config.LLM_MODEL, Config.LLM_TEMPERATURE, Config.RELEVANCE_THRESHOLD)
 
 
-def classify_article_relevance_with_settings(article: NewsArticle, criteria: str, llm_model: str = None, llm_temperature: float = None, relevance_threshold: float = None) -> dict:
-    """Классификация статьи по релевантности с указанными настройками"""
+def classify_article_relevance_with_settings(article: NewsArticle, criteria: str, llm_model: str = None, llm_temperature: float = None, relevance_threshold: float = None, with_summary: bool = False) -> dict:
+    """Классификация статьи по релевантности с указанными настройками
+    
+    При with_summary в том же запросе для релевантной статьи запрашивается
+    саммари (поле 'summary' результата).
+    """
     if llm_model is None:
         llm_model = Config.LLM_MODEL
     if llm_temperature is None:
@@ -106,7 +184,7 @@ def classify_article_relevance_with_settings(article: NewsArticle, criteria: str
     # Сначала пробуем прямой HTTP запрос, если указан кастомный API
     if Config.OPENAI_API_BASE:
         try:
-            return classify_with_direct_api(article, criteria, llm_model, llm_temperature, relevance_threshold)
+            return classify_with_direct_api(article, criteria, llm_model, llm_temperature, relevance_threshold, with_summary)
         except Exception as e:
             print(f"Прямой API запрос не удался: {e}, пробуем через langchain")
     
@@ -118,68 +196,22 @@ def classify_article_relevance_with_settings(article: NewsArticle, criteria: str
         # Fallback на простую классификацию
         return simple_classification(article, criteria, relevance_threshold)
     
-    prompt = f"""Проанализируй следующую новость и определи её релевантность к критерию отбора.
-
-Критерий отбора: {criteria}
-
-Заголовок: {article.title}
-Содержание: {article.content[:500] if article.content else 'Нет содержания'}
-
-Ответь в формате JSON:
-{{
-    "relevance_score": <число от 0.0 до 1.0>,
-    "is_relevant": <true или false>,
-    "reason": "<краткое объяснение причины>"
-}}
-
-Где:
-- relevance_score: оценка релевантности (0.0 - не релевантно, 1.0 - полностью релевантно)
-- is_relevant: true если relevance_score >= {relevance_threshold}, иначе false
-- reason: краткое объяснение почему статья релевантна или нет
-"""
+    prompt = _build_single_prompt(article, criteria, relevance_threshold, with_summary)
     
     try:
         # Логирование для отладки
         if Config.OPENAI_API_BASE:
             print(f"Используется API: {Config.OPENAI_API_BASE}, модель: {llm_model}, temperature: {llm_temperature}")
         
-        response = llm.invoke(prompt)
-        # Парсинг ответа (упрощенный вариант)
-        content = response.content if hasattr(response, 'content') else str(response)
-        
-        # Извлечение JSON из ответа
-        import json
-        import re
+        content = langchain_json_completion(llm, prompt, llm_model, _output_tokens(with_summary))
         
-        # Улучшенный поиск JSON - ищем вложенные объекты
-        json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', content, re.DOTALL)
-        if not json_match:
-            # Попробуем найти JSON между ```json и ``` или просто между ```
-            json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', content, re.DOTALL)
-            if json_match:
-                json_match = json_match.group(1)
-            else:
-                # Попробуем найти любой JSON объект
-                json_match = re.search(r'\{.*\}', content, re.DOTALL)
-        
-        if json_match:
-            json_str = json_match.group() if hasattr(json_match, 'group') else json_match
-            try:
-                result = json.loads(json_str)
-                return {
-                    'relevance_score': float(result.get('relevance_score', 0.0)),
-                    'is_relevant': bool(result.get('is_relevant', False)),
-                    'reason': result.get('reason', '')
-                }
-            except json.JSONDecodeError as e:
-                print(f"Ошибка парсинга JSON для статьи {article.id}: {e}")
-                print(f"Полученный ответ: {content[:200]}")
-                return simple_classification(article, criteria)
-        else:
-            # Fallback: простая оценка по ключевым словам
-            print(f"JSON не найден в ответе для статьи {article.id}, используем простую классификацию")
-            print(f"Полученный ответ: {content[:200]}")
-            return simple_classification(article, criteria)
+        result = _parse_single_response(content, relevance_threshold)
+        if result is not None:
+            return result
+        # Fallback: простая оценка по ключевым словам
+        print(f"JSON не найден в ответе для статьи {article.id}, используем простую классификацию")
+        print(f"Полученный ответ: {content[:200]}")
+        return simple_classification(article, criteria, relevance_threshold)
             
     except Exception as e:
         error_msg = str(e)
@@ -193,50 +225,205 @@ def classify_article_relevance_with_settings(article: NewsArticle, criteria: str
         
         import traceback
         traceback.print_exc()
-        return simple_classification(article, criteria)
+        return simple_classification(article, criteria, relevance_threshold)
+
+
+# Удаление знаков препинания при разбиении текста на слова (быстрее str.translate для кириллицы)
+_PUNCTUATION_RE = re.compile('[' + re.escape(string.punctuation) + ']')
+
+
+class CriteriaMatcher:
+    """Скомпилированный критерий отбора для простой классификации по ключевым словам
+    
+    Слова критерия (от 3 символов) разбираются один раз. Частичное совпадение
+    слова критерия с каким-либо словом текста проверяется без перебора пар:
+    слово критерия внутри слова текста - поиском подстроки в очищенном тексте
+    (слова критерия не содержат пробелов), слово текста внутри слова критерия -
+    по индексу всех подстрок слов критерия. Оценки совпадают с прежним
+    попарным сравнением слов.
+    """
+    
+    def __init__(self, criteria: str):
+        criteria_clean = _PUNCTUATION_RE.sub('', criteria.lower())
+        self.words = tuple(sorted(set(w for w in criteria_clean.split() if len(w) >= 3)))
+        # Подстроки слов критерия длиной от 3 символов -> индексы слов, в которые они входят
+        self.substrings = {}
+        for index, word in enumerate(self.words):
+            for start in range(len(word) - 2):
+                for end in range(start + 3, len(word) + 1):
+                    self.substrings.setdefault(word[start:end], set()).add(index)
+    
+    def match(self, title: str, content: str) -> tuple:
+        """Количество точных и частичных совпадений слов критерия с текстом"""
+        text_clean = _PUNCTUATION_RE.sub('', f"{title} {content or ''}".lower())
+        # Короткие слова не отбрасываются: со словами критерия и их подстроками (от 3 символов) они не совпадут
+        text_words = set(text_clean.split())
+        
+        matches = 0
+        partial = set()
+        for word in text_words.intersection(self.substrings):
+            partial.update(self.substrings[word])
+        for index, word in enumerate(self.words):
+            if word in text_words:
+                matches += 1
+            if index not in partial and word in text_clean:
+                partial.add(index)
+        return matches, len(partial)
+    
+    def classify(self, article: NewsArticle, relevance_threshold: float) -> dict:
+        """Результат простой классификации статьи (формат classify_*)"""
+        matches, partial_matches = self.match(article.title, article.content)
+        total_words = len(self.words)
+        
+        # Комбинируем точные и частичные совпадения
+        if total_words == 0:
+            score = 0.0
+        else:
+            # Вес точных совпадений выше
+            exact_score = matches / total_words
+            partial_score = partial_matches / total_words * 0.5
+            score = min(exact_score + partial_score, 1.0)
+        
+        return {
+            'relevance_score': score,
+            'is_relevant': score >= relevance_threshold,
+            'reason': f'Простая классификация: {matches} точных совпадений, {partial_matches} частичных из {total_words} ключевых слов',
+            # Результат без LLM - не сохраняется в кэш классификации
+            'fallback': True
+        }
+    
+    def classify_many(self, articles: List[NewsArticle], relevance_threshold: float) -> dict:
+        """Результаты простой классификации списка статей {ID статьи: результат}"""
+        return {article.id: self.classify(article, relevance_threshold) for article in articles}
+
+
+@lru_cache(maxsize=32)
+def get_criteria_matcher(criteria: str) -> CriteriaMatcher:
+    """Скомпилированный критерий отбора (один на критерий, общий для потоков)"""
+    return CriteriaMatcher(criteria)
 
 
 def simple_classification(article: NewsArticle, criteria: str, relevance_threshold: float = None) -> dict:
     """Простая классификация по ключевым словам (fallback)"""
     if relevance_threshold is None:
         relevance_threshold = Config.RELEVANCE_THRESHOLD
-    """Простая классификация на основе ключевых слов (fallback)"""
-    text = f"{article.title} {article.content or ''}".lower()
-    criteria_lower = criteria.lower()
-    
-    # Улучшенная обработка: удаляем стоп-слова и знаки препинания
-    import string
-    # Удаляем знаки препинания
-    text_clean = text.translate(str.maketrans('', '', string.punctuation))
-    criteria_clean = criteria_lower.translate(str.maketrans('', '', string.punctuation))
-    
-    # Разбиваем на слова и фильтруем короткие слова (меньше 3 символов)
-    criteria_words = set([w for w in criteria_clean.split() if len(w) >= 3])
-    text_words = set([w for w in text_clean.split() if len(w) >= 3])
-    
-    matches = len(criteria_words.intersection(text_words))
-    total_words = len(criteria_words)
-    
-    # Также проверяем частичные совпадения (подстроки)
-    partial_matches = 0
-    for crit_word in criteria_words:
-        if any(crit_word in text_word or text_word in crit_word for text_word in text_words):
-            partial_matches += 1
-    
-    # Комбинируем точные и частичные совпадения
-    if total_words == 0:
-        score = 0.0
-    else:
-        # Вес точных совпадений выше
-        exact_score = matches / total_words
-        partial_score = partial_matches / total_words * 0.5
-        score = min(exact_score + partial_score, 1.0)
-    
-    return {
-        'relevance_score': score,
-        'is_relevant': score >= relevance_threshold,
-        'reason': f'Простая классификация: {matches} точных совпадений, {partial_matches} частичных из {total_words} ключевых слов'
-    }
+    return get_criteria_matcher(criteria).classify(article, relevance_threshold)
+
+
+def _build_batch_prompt(articles: List[NewsArticle], criteria: str, relevance_threshold: float, with_summary: bool = False) -> str:
+    """Промпт для классификации нескольких статей одним запросом (with_summary - с условным саммари)"""
+    items = []
+    for article in articles:
+        items.append(f"""[id: {article.id}]
+Заголовок: {article.title}
+Содержание: {_prompt_content(article, with_summary)}""")
+    articles_text = '\n\n'.join(items)
+    summary_field = ',\n            "summary": "<саммари или null>"' if with_summary else ''
+    summary_rule = _summary_rule(relevance_threshold) if with_summary else ''
+    
+    return f"""Проанализируй следующие новости и определи релевантность каждой к критерию отбора.
+
+Критерий отбора: {criteria}
+
+Новости:
+
+{articles_text}
+
+Ответь JSON объектом с массивом results, по одному элементу на каждую новость, в том же порядке:
+{{
+    "results": [
+        {{
+            "id": <id новости из квадратных скобок>,
+            "relevance_score": <число от 0.0 до 1.0>,
+            "is_relevant": <true или false>,
+            "reason": "<краткое объяснение причины>"{summary_field}
+        }}
+    ]
+}}
+
+Где:
+- relevance_score: оценка релевантности (0.0 - не релевантно, 1.0 - полностью релевантно)
+- is_relevant: true если relevance_score >= {relevance_threshold}, иначе false
+- reason: краткое объяснение почему статья релевантна или нет{summary_rule}
+"""
+
+
+def _parse_batch_response(content: str, relevance_threshold: float) -> dict:
+    """Разбор ответа пакетной классификации ({"results": [...]} или массив) в {id статьи: результат}
+    
+    Элементы без корректного id или relevance_score пропускаются - такие статьи
+    классифицируются повторно по одной. is_relevant определяется порогом relevance_threshold.
+    """
+    parsed = parse_json_value(content)
+    items = parsed
+    if isinstance(parsed, dict):
+        items = parsed.get('results')
+        if items is None:
+            # Модель могла назвать массив результатов по-другому
+            items = next((value for value in parsed.values() if isinstance(value, list)), None)
+    if not isinstance(items, list):
+        return {}
+    
+    results = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            article_id = int(item['id'])
+            relevance_score = float(item['relevance_score'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        results[article_id] = _attach_summary({
+            'relevance_score': relevance_score,
+            'is_relevant': relevance_score >= relevance_threshold,
+            'reason': item.get('reason', '')
+        }, item)
+    return results
+
+
+def classify_articles_batch(articles: List[NewsArticle], criteria: str, llm_model: str = None, llm_temperature: float = None, relevance_threshold: float = None, with_summary: bool = False) -> dict:
+    """Классификация нескольких статей одним запросом к LLM
+    
+    Возвращает {id статьи: результат}. Статьи, которых нет в ответе или
+    которые не удалось разобрать, классифицируются отдельными запросами.
+    """
+    if llm_model is None:
+        llm_model = Config.LLM_MODEL
+    if llm_temperature is None:
+        llm_temperature = Config.LLM_TEMPERATURE
+    if relevance_threshold is None:
+        relevance_threshold = Config.RELEVANCE_THRESHOLD
+    
+    results = {}
+    if len(articles) > 1:
+        prompt = _build_batch_prompt(articles, criteria, relevance_threshold, with_summary)
+        output_tokens = _output_tokens(with_summary) * len(articles)
+        content = None
+        # Сначала пробуем прямой HTTP запрос, если указан кастомный API
+        if Config.OPENAI_API_BASE:
+            try:
+                content = _direct_chat_completion(prompt, llm_model, llm_temperature, timeout=30 + 10 * len(articles),
+                                                  output_tokens=output_tokens)
+            except Exception as e:
+                print(f"Прямой API запрос не удался: {e}, пробуем через langchain")
+        if content is None:
+            try:
+                llm = create_llm_with_settings(llm_model, llm_temperature)
+                content = langchain_json_completion(llm, prompt, llm_model, output_tokens)
+            except Exception as e:
+                print(f"Ошибка пакетной классификации {len(articles)} статей: {e}")
+        
+        if content is not None:
+            parsed = _parse_batch_response(content, relevance_threshold)
+            article_ids = {article.id for article in articles}
+            results = {article_id: result for article_id, result in parsed.items() if article_id in article_ids}
+            if len(results) < len(articles):
+                print(f"В ответе пакетной классификации разобрано {len(results)} из {len(articles)} статей, остальные классифицируются по одной")
+    
+    for article in articles:
+        if article.id not in results:
+            results[article.id] = classify_article_relevance_with_settings(article, criteria, llm_model, llm_temperature, relevance_threshold, with_summary)
+    return results
 
 
 def classify_articles(articles: List[NewsArticle], criteria: str):
@@ -244,34 +431,211 @@ def classify_articles(articles: List[NewsArticle], criteria: str):
     classify_articles_with_settings(articles, criteria, Config.LLM_MODEL, Config.LLM_TEMPERATURE, Config.RELEVANCE_THRESHOLD)
 
 
-def classify_articles_with_settings(articles: List[NewsArticle], criteria: str, llm_model: str = None, llm_temperature: float = None, relevance_threshold: float = None):
-    """Классификация списка статей с указанными настройками"""
+def _save_classification_results(session, articles: List[NewsArticle]):
+    """Сохранение результатов классификации пакетным UPDATE по ID статей"""
+    if not articles:
+        return
+    update_by_id(session, NewsArticle, [
+        {
+            'id': article.id,
+            'relevance_score': article.relevance_score,
+            'is_relevant': article.is_relevant,
+            'classification_reason': article.classification_reason
+        }
+        for article in articles
+    ])
+    # Саммари, полученные вместе с классификацией
+    update_by_id(session, NewsArticle, [
+        {'id': article.id, 'summary': article.summary} for article in articles if article.summary
+    ])
+    session.commit()
+
+
+def prefilter_by_embeddings(articles: List[NewsArticle], criteria: str, min_similarity: float = None,
+                            search_history_id: int = None) -> List[NewsArticle]:
+    """Предварительный отбор статей для LLM классификации по embeddings
+    
+    Критерий отбора векторизуется один раз, статьи с косинусным сходством
+    с ним ниже min_similarity (`PREFILTER_MIN_SIMILARITY`) сразу получают оценку
+    0.0 (нерелевантна) и в LLM не отправляются. Недостающие embeddings статей
+    генерируются и сохраняются в БД (этап генерации embeddings их не пересчитывает).
+    Статьи без embedding, а также все статьи при ошибке векторизации критерия
+    остаются для LLM. Возвращает статьи, которые нужно классифицировать.
+    """
+    if min_similarity is None:
+        min_similarity = Config.PREFILTER_MIN_SIMILARITY
+    pending = [article for article in articles if not article.is_duplicate]
+    if min_similarity <= 0 or not pending or not (criteria or '').strip():
+        return pending
+    
+    criteria_embedding = generate_embedding_with_openai(criteria.strip(), EMBEDDING_MODEL)
+    if not criteria_embedding:
+        print("Не удалось получить embedding критерия отбора, предварительный фильтр пропущен")
+        return pending
+    
+    article_ids = [article.id for article in pending]
+    try:
+        generate_embeddings_for_articles_by_ids(article_ids, search_history_id)
+        embeddings_by_id = load_embeddings(article_ids)
+    except Exception as e:
+        print(f"Ошибка при получении embeddings статей, предварительный фильтр пропущен: {e}")
+        return pending
+    
+    # Первая строка матрицы - критерий; статьи другой размерности в сравнении не участвуют
+    matrix, indexes = normalize_embeddings([criteria_embedding] + [embeddings_by_id.get(article_id) for article_id in article_ids])
+    if not indexes or indexes[0] != 0:
+        return pending
+    similarities = dict(zip(indexes[1:], (matrix[1:] @ matrix[0]).tolist()))
+    
+    remaining = []
+    skipped = []
+    for position, article in enumerate(pending, start=1):
+        similarity = similarities.get(position)
+        if similarity is None or similarity >= min_similarity:
+            remaining.append(article)
+            continue
+        article.relevance_score = 0.0
+        article.is_relevant = False
+        article.classification_reason = f'Предварительный фильтр: сходство с критерием {similarity:.2f} ниже {min_similarity:.2f}'
+        skipped.append(article)
+    
+    if skipped:
+        session = get_db_session()
+        try:
+            _save_classification_results(session, skipped)
+        except Exception as e:
+            session.rollback()
+            print(f"Ошибка при сохранении результатов предварительного фильтра: {e}")
+            return pending
+        finally:
+            session.close()
+    print(f"Предварительный фильтр: {len(skipped)} из {len(pending)} статей отсеяно без LLM")
+    return remaining
+
+
+def classify_articles_with_settings(articles: List[NewsArticle], criteria: str, llm_model: str = None, llm_temperature: float = None, relevance_threshold: float = None, batch_size: int = None, concurrency: int = None, progress_callback=None, with_summary: bool = False, search_history_id: int = None) -> dict:
+    """Классификация списка статей с указанными настройками
+    
+    Статьи отправляются в LLM пакетами по batch_size (`CLASSIFICATION_BATCH_SIZE`),
+    при batch_size = 1 - по одной статье на запрос. Одновременно выполняется
+    не более concurrency запросов (`CLASSIFICATION_CONCURRENCY`). После каждого
+    завершенного запроса вызывается progress_callback(обработано, всего),
+    результаты сохраняются в БД порциями по мере готовности.
+    
+    Перед обращением к LLM результаты ищутся в кэше классификации
+    (`CLASSIFICATION_CACHE_ENABLED`) по content_hash статьи, критерию, модели,
+    temperature и версии промпта; новые результаты LLM добавляются в кэш.
+    Предварительный фильтр по embeddings (`PREFILTER_MIN_SIMILARITY`) применяется
+    только к статьям, не найденным в кэше, поэтому не заменяет закэшированную
+    оценку LLM более грубой оценкой фильтра.
+    
+    При with_summary (режим саммари combined) релевантные статьи получают
+    саммари в том же ответе LLM, что и оценку: текст статьи отправляется
+    один раз, отдельный запрос саммари не нужен. Статьи из кэша и простой
+    классификации остаются без саммари и получают его на этапе саммари.
+    
+    Возвращает статистику: {'cached': из кэша, 'prefilter_skipped': отсеяно фильтром}.
+    """
     if llm_model is None:
         llm_model = Config.LLM_MODEL
     if llm_temperature is None:
         llm_temperature = Config.LLM_TEMPERATURE
     if relevance_threshold is None:
         relevance_threshold = Config.RELEVANCE_THRESHOLD
+    if batch_size is None:
+        batch_size = Config.CLASSIFICATION_BATCH_SIZE
+    if concurrency is None:
+        concurrency = Config.CLASSIFICATION_CONCURRENCY
+    batch_size = max(1, batch_size)
+    concurrency = max(1, concurrency)
+    
+    def classify_batch(batch):
+        if len(batch) == 1:
+            return {batch[0].id: classify_article_relevance_with_settings(batch[0], criteria, llm_model, llm_temperature, relevance_threshold, with_summary)}
+        return classify_articles_batch(batch, criteria, llm_model, llm_temperature, relevance_threshold, with_summary)
     
+    stats = {'cached': 0, 'prefilter_skipped': 0}
     session = get_db_session()
     
     try:
-        for article in articles:
-            if article.is_duplicate:
-                continue  # Пропускаем дубликаты
-            
-            result = classify_article_relevance_with_settings(article, criteria, llm_model, llm_temperature, relevance_threshold)
+        # Пропускаем дубликаты
+        pending = [article for article in articles if not article.is_duplicate]
+        total = len(pending)
+        done = 0
+        unsaved = []
+        to_cache = {}
+        
+        if Config.CLASSIFICATION_CACHE_ENABLED and pending:
+            cached = load_cached_classifications(
+                session, [article.content_hash for article in pending], criteria,
+                llm_model, llm_temperature, _prompt_version(with_summary)
+            )
+            if cached:
+                remaining = []
+                for article in pending:
+                    if article.content_hash in cached:
+                        article.relevance_score, article.classification_reason = cached[article.content_hash]
+                        article.is_relevant = article.relevance_score >= relevance_threshold
+                        unsaved.append(article)
+                    else:
+                        remaining.append(article)
+                pending = remaining
+                done = len(unsaved)
+                stats['cached'] = done
+                print(f"Из кэша классификации получено {done} из {total} статей")
+                _save_classification_results(session, unsaved)
+                unsaved = []
+                if progress_callback:
+                    progress_callback(done, total)
+        
+        # Статьи, далекие от критерия по embeddings, не отправляются в LLM
+        remaining = prefilter_by_embeddings(pending, criteria, search_history_id=search_history_id)
+        if len(remaining) < len(pending):
+            stats['prefilter_skipped'] = len(pending) - len(remaining)
+            done += stats['prefilter_skipped']
+            pending = remaining
+            if progress_callback:
+                progress_callback(done, total)
+        
+        batches = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
             
-            article.relevance_score = result['relevance_score']
-            article.is_relevant = result['is_relevant']
-            article.classification_reason = result['reason']
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {executor.submit(classify_batch, batch): batch for batch in batches}
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    print(f"Ошибка при классификации пакета из {len(batch)} статей: {e}")
+                    results = get_criteria_matcher(criteria).classify_many(batch, relevance_threshold)
             
-            session.merge(article)
+                for article in batch:
+                    result = results[article.id]
+                    article.relevance_score = result['relevance_score']
+                    # Как и для результатов из кэша: релевантность определяется только порогом
+                    article.is_relevant = article.relevance_score >= relevance_threshold
+                    article.classification_reason = result['reason']
+                    if result.get('summary') and not article.summary:
+                        article.summary = result['summary']
+                    if Config.CLASSIFICATION_CACHE_ENABLED and article.content_hash and not result.get('fallback'):
+                        to_cache[article.content_hash] = (article.relevance_score, article.classification_reason)
+                unsaved.extend(batch)
         
-        session.commit()
+                if len(unsaved) >= CLASSIFICATION_SAVE_EVERY:
+                    _save_classification_results(session, unsaved)
+                    store_classifications(session, to_cache, criteria, llm_model, llm_temperature, _prompt_version(with_summary))
+                    unsaved = []
+                    to_cache = {}
+                
+                done += len(batch)
+                if progress_callback:
+                    progress_callback(done, total)
+        
+        _save_classification_results(session, unsaved)
+        store_classifications(session, to_cache, criteria, llm_model, llm_temperature, _prompt_version(with_summary))
     except Exception as e:
         session.rollback()
         print(f"Ошибка при классификации: {e}")
     finally:
         session.close()
-
+    return stats
@@ -0,0 +1,69 @@
+"""Общие утилиты пакетной работы с БД
+
+Запросы IN (...) по большим спискам значений выполняются порциями по
+IN_CHUNK_SIZE, многострочные INSERT - порциями, укладывающимися в
+MAX_SQL_PARAMETERS, обновления по ID - одним UPDATE с executemany, а строки
+кэшей добавляются пакетно с пропуском записей, уже добавленных другим процессом.
+"""
+from sqlalchemy import update, bindparam
+from sqlalchemy.exc import IntegrityError
+
+# Максимальное количество значений в одном запросе IN (...)
+IN_CHUNK_SIZE = 500
+
+# Максимальное количество параметров в одном запросе (SQLite до 3.32 - 999)
+MAX_SQL_PARAMETERS = 999
+
+
+def iter_chunks(values: list, size: int = IN_CHUNK_SIZE):
+    """Порции списка values по size элементов"""
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def rows_per_statement(columns_count: int) -> int:
+    """Количество строк многострочного INSERT, укладывающееся в MAX_SQL_PARAMETERS"""
+    return max(1, MAX_SQL_PARAMETERS // max(1, columns_count))
+
+
+def update_by_id(session, model, rows: list, **values):
+    """Пакетный UPDATE строк model по ID (executemany, без commit)
+    
+    rows - словари {'id': ID, колонка: значение, ...} с одинаковым набором колонок,
+    values - значения, общие для всех строк. Удаленные к этому моменту строки
+    пропускаются.
+    """
+    if not rows:
+        return
+    table = model.__table__
+    columns = [name for name in rows[0] if name != 'id']
+    # Имена параметров не должны совпадать с именами колонок
+    values.update({name: bindparam(f'new_{name}') for name in columns})
+    session.execute(
+        update(table).where(table.c.id == bindparam('row_id')).values(**values),
+        [{'row_id': row['id'], **{f'new_{name}': row[name] for name in columns}} for row in rows]
+    )
+
+
+def insert_missing(session, model, rows: list, key: str, find_existing):
+    """Пакетное добавление строк model с пропуском существующих записей
+    
+    При нарушении уникальности транзакция откатывается, find_existing(значения
+    поля key) возвращает значения, для которых запись уже есть, и добавляются
+    только остальные строки.
+    """
+    if not rows:
+        return
+    try:
+        session.bulk_insert_mappings(model, rows)
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        existing = set(find_existing([row[key] for row in rows]))
+        rows = [row for row in rows if row[key] not in existing]
+        if rows:
+            try:
+                session.bulk_insert_mappings(model, rows)
+                session.commit()
+            except IntegrityError:
+                session.rollback()
@@ -1,9 +1,23 @@
 """Модуль для дедупликации новостей"""
+from datetime import datetime
 from config import Config
-from models import NewsArticle, get_db_session
+from models import NewsArticle, DuplicateCluster, get_db_session
+from agents.minhash import MinHasher, LSHIndex, get_shingles
+from agents.embeddings import generate_embeddings_for_articles_by_ids, load_embeddings, normalize_embeddings, find_similar_pairs
+from agents.db_utils import iter_chunks, update_by_id
+from sqlalchemy import func, update, bindparam
+from concurrent.futures import ProcessPoolExecutor
 from typing import List
 import difflib
 
+# Меньше этого количества пар сравнение в пуле процессов не окупает запуск процессов
+PARALLEL_MIN_PAIRS = 2000
+# Количество пар в одной задаче пула процессов
+PAIR_CHUNK_SIZE = 1000
+
+# Тексты статей в процессе пула (передаются один раз при запуске процесса)
+_worker_texts = None
+
 
 def calculate_similarity(text1: str, text2: str) -> float:
     """Вычисление схожести двух текстов"""
@@ -18,62 +32,294 @@ def calculate_similarity(text1: str, text2: str) -> float:
     return similarity
 
 
-def find_duplicates(articles: List[NewsArticle], threshold: float = None, search_history_id: int = None) -> dict:
-    """Поиск дубликатов среди статей (в рамках одного запроса)"""
+def calculate_similarity_at_least(text1: str, text2: str, minimum: float) -> float:
+    """Схожесть двух текстов или 0.0, если она заведомо ниже minimum
+    
+    Перед полным ratio() проверяются дешевые верхние оценки: отношение длин,
+    real_quick_ratio() и quick_ratio(). Каждая из них не меньше ratio(),
+    поэтому результат сравнения с minimum совпадает с calculate_similarity().
+    """
+    text1 = text1.lower().strip()
+    text2 = text2.lower().strip()
+    
+    if not text1 or not text2:
+        return 0.0
+    
+    if 2.0 * min(len(text1), len(text2)) / (len(text1) + len(text2)) < minimum:
+        return 0.0
+    matcher = difflib.SequenceMatcher(None, text1, text2)
+    if matcher.real_quick_ratio() < minimum or matcher.quick_ratio() < minimum:
+        return 0.0
+    return matcher.ratio()
+
+
+def is_near_duplicate_text(title1: str, content1: str, title2: str, content2: str, threshold: float) -> bool:
+    """Правило дубликата: похожие заголовки или заголовки от 0.7 и похожее содержимое"""
+    # Сравнение заголовков и содержимого
+    title_sim = calculate_similarity_at_least(title1, title2, min(threshold, 0.7))
+    if title_sim >= threshold:
+        return True
+    if title_sim < 0.7:
+        return False
+    content_sim = calculate_similarity_at_least(content1 or '', content2 or '', threshold)
+    return content_sim >= threshold
+
+
+def is_near_duplicate(article1: NewsArticle, article2: NewsArticle, threshold: float) -> bool:
+    """Правило дубликата для двух статей"""
+    return is_near_duplicate_text(article1.title, article1.content, article2.title, article2.content, threshold)
+
+
+def _init_pair_worker(texts: list):
+    """Инициализация процесса пула: тексты статей (заголовок, содержимое) по индексам"""
+    global _worker_texts
+    _worker_texts = texts
+
+
+def _compare_pair_chunk(pairs: list, threshold: float) -> list:
+    """Результаты правила дубликата для порции пар индексов (выполняется в процессе пула)"""
+    return [
+        is_near_duplicate_text(*_worker_texts[i], *_worker_texts[j], threshold)
+        for i, j in pairs
+    ]
+
+
+def compare_pairs(texts: list, pairs: list, threshold: float, workers: int = None) -> list:
+    """Правило дубликата для каждой пары индексов в texts, в порядке pairs
+    
+    texts - список (заголовок, содержимое). При workers > 1 и достаточном
+    количестве пар пары делятся на порции и сравниваются в пуле процессов.
+    """
+    if workers is None:
+        workers = Config.DEDUP_WORKERS
+    
+    if workers <= 1 or len(pairs) < PARALLEL_MIN_PAIRS:
+        return [is_near_duplicate_text(*texts[i], *texts[j], threshold) for i, j in pairs]
+    
+    chunks = [pairs[start:start + PAIR_CHUNK_SIZE] for start in range(0, len(pairs), PAIR_CHUNK_SIZE)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_pair_worker, initargs=(texts,)) as executor:
+        for chunk_result in executor.map(_compare_pair_chunk, chunks, [threshold] * len(chunks)):
+            results.extend(chunk_result)
+    return results
+
+
+def find_candidate_pairs(articles: List[NewsArticle], method: str = None) -> list:
+    """Пары индексов (i, j), i < j, статей для точного сравнения в порядке обхода
+    
+    Метод `exact` возвращает все пары. Метод `minhash` возвращает только пары,
+    заголовки которых совпали хотя бы в одной полосе LSH индекса: правило
+    дубликата требует схожести заголовков не ниже 0.7, а такие пары попадают
+    в кандидаты с вероятностью около 99%.
+    """
+    if method is None:
+        method = Config.DEDUP_METHOD
+    
+    if method == 'exact':
+        return [(i, j) for i in range(len(articles)) for j in range(i + 1, len(articles))]
+    if method != 'minhash':
+        raise ValueError(f"Неизвестный метод дедупликации: {method}")
+    
+    hasher = MinHasher(Config.DEDUP_LSH_BANDS * Config.DEDUP_LSH_ROWS)
+    index = LSHIndex(Config.DEDUP_LSH_BANDS, Config.DEDUP_LSH_ROWS)
+    for i, article in enumerate(articles):
+        shingles = get_shingles(article.title)
+        # Пустой заголовок дает нулевую схожесть - такую статью не с чем сравнивать
+        if shingles:
+            index.add(i, hasher.signature(shingles))
+    return sorted(index.candidate_pairs())
+
+
+class UnionFind:
+    """Система непересекающихся множеств по ID статей (сжатие путей, объединение по размеру)"""
+    
+    def __init__(self):
+        self._parent = {}
+        self._size = {}
+    
+    def __contains__(self, key) -> bool:
+        return key in self._parent
+    
+    def __iter__(self):
+        return iter(self._parent)
+    
+    def find(self, key):
+        """Корень множества, содержащего key (новый ключ образует свое множество)"""
+        if key not in self._parent:
+            self._parent[key] = key
+            self._size[key] = 1
+            return key
+        root = key
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while self._parent[key] != root:
+            self._parent[key], key = root, self._parent[key]
+        return root
+    
+    def union(self, key1, key2) -> bool:
+        """Объединение множеств; False, если ключи уже в одном множестве"""
+        root1 = self.find(key1)
+        root2 = self.find(key2)
+        if root1 == root2:
+            return False
+        if self._size[root1] < self._size[root2]:
+            root1, root2 = root2, root1
+        self._parent[root2] = root1
+        self._size[root1] += self._size[root2]
+        return True
+    
+    def groups(self) -> dict:
+        """Множества в виде {корень: [ключи]}"""
+        result = {}
+        for key in self._parent:
+            result.setdefault(self.find(key), []).append(key)
+        return result
+
+
+def _original_sort_key(article: NewsArticle):
+    """Порядок выбора оригинала: более ранняя дата публикации, статьи без даты - после, затем меньший ID"""
+    return (article.published_at is None, article.published_at or datetime.min, article.id)
+
+
+def find_embedding_pairs(articles: List[NewsArticle], threshold: float = None, search_history_id: int = None) -> list:
+    """Пары индексов (i, j), i < j, статей с косинусным сходством embeddings не ниже порога
+    
+    Недостающие embeddings сначала генерируются и сохраняются в БД (этап
+    генерации embeddings их потом не пересчитывает). Статьи, для которых
+    embedding получить не удалось, в сравнении не участвуют.
+    """
+    if threshold is None:
+        threshold = Config.DEDUP_EMBEDDING_THRESHOLD
+    
+    article_ids = [article.id for article in articles if article.id]
+    generate_embeddings_for_articles_by_ids(article_ids, search_history_id)
+    embeddings_by_id = load_embeddings(article_ids)
+    
+    matrix, indexes = normalize_embeddings([embeddings_by_id.get(article.id) for article in articles])
+    return [
+        (indexes[i], indexes[j])
+        for i, j in find_similar_pairs(matrix, threshold, Config.DEDUP_EMBEDDING_BLOCK_SIZE)
+    ]
+
+
+def find_duplicates(articles: List[NewsArticle], threshold: float = None, search_history_id: int = None,
+                    workers: int = None) -> dict:
+    """Поиск дубликатов среди статей (в рамках одного запроса)
+    
+    Совпадения по канонической ссылке, хешу и схожести текста объединяются
+    в кластеры (union-find). Оригиналом кластера считается статья с самой
+    ранней датой публикации; если в кластер попала уже обработанная статья
+    (совпадение хеша со статьей вне списка), оригинал ее кластера сохраняется.
+    Сравнение текстов выполняется в пуле из workers процессов (`DEDUP_WORKERS`),
+    результат не зависит от количества процессов.
+    Возвращает {ID дубликата: ID оригинала кластера} без цепочек.
+    """
     if threshold is None:
         threshold = Config.SIMILARITY_THRESHOLD
     
     duplicates = {}
+    clusters = UnionFind()
+    articles_by_id = {article.id: article for article in articles if article.id}
+    for article_id in articles_by_id:
+        clusters.find(article_id)
+    
     session = get_db_session()
     
     try:
-        # Проверка по хешу (точные дубликаты) - только в рамках одного запроса
-        for article in articles:
-            if not article.id or not article.content_hash:
+        # Проверка по канонической ссылке
+        first_by_link = {}
+        for article_id in sorted(articles_by_id):
+            canonical_link = articles_by_id[article_id].canonical_link
+            if not canonical_link:
                 continue
-            
-            query = session.query(NewsArticle).filter(
-                NewsArticle.content_hash == article.content_hash,
-                NewsArticle.id != article.id
+            if canonical_link in first_by_link:
+                clusters.union(first_by_link[canonical_link], article_id)
+            else:
+                first_by_link[canonical_link] = article_id
+        
+        # Проверка по хешу (точные дубликаты) - только в рамках одного запроса.
+        # Один сгруппированный запрос на порцию хешей: статья с меньшим ID может быть уже обработанной
+        hashes = list({article.content_hash for article in articles_by_id.values() if article.content_hash})
+        first_by_hash = {}
+        for chunk in iter_chunks(hashes):
+            query = session.query(NewsArticle.content_hash, func.min(NewsArticle.id)).filter(
+                NewsArticle.content_hash.in_(chunk)
             )
             
             # Если указан search_history_id, ищем дубликаты только в этом запросе
             if search_history_id:
                 query = query.filter(NewsArticle.search_history_id == search_history_id)
             
-            existing = query.first()
+            first_by_hash.update(query.group_by(NewsArticle.content_hash).all())
             
-            if existing:
-                duplicates[article.id] = existing.id
-                continue
+        for article in articles_by_id.values():
+            original_id = first_by_hash.get(article.content_hash)
+            if original_id is not None and original_id != article.id:
+                clusters.union(original_id, article.id)
         
-        # Проверка по схожести текста
-        for i, article1 in enumerate(articles):
-            if not article1.id or article1.id in duplicates:
-                continue
-                
-            for article2 in articles[i+1:]:
-                if not article2.id or article2.id in duplicates:
+        # Проверка по схожести текста (только пары-кандидаты). В режиме embedding пары отбираются LSH индексом.
+        # LSH индекс рассчитан на схожесть заголовков от 0.7, при более низком пороге сравниваем все пары
+        dedup_method = Config.DEDUP_METHOD
+        method = 'minhash' if dedup_method == 'embedding' else dedup_method
+        if threshold < 0.7:
+            method = 'exact'
+        pairs = [
+            (i, j) for i, j in find_candidate_pairs(articles, method)
+            if articles[i].id and articles[j].id
+        ]
+        if workers is None:
+            workers = Config.DEDUP_WORKERS
+        if workers > 1 and len(pairs) >= PARALLEL_MIN_PAIRS:
+            # Параллельно сравниваются все пары, затем кластеры собираются в том же порядке.
+            # Последовательный путь пропускает только пары, уже связанные в кластере,
+            # поэтому итоговые кластеры совпадают
+            texts = [(article.title, article.content) for article in articles]
+            for (i, j), is_duplicate in zip(pairs, compare_pairs(texts, pairs, threshold, workers)):
+                if is_duplicate:
+                    clusters.union(articles[i].id, articles[j].id)
+        else:
+            # Пары из одного кластера не сравниваются
+            for i, j in pairs:
+                article1 = articles[i]
+                article2 = articles[j]
+                if clusters.find(article1.id) == clusters.find(article2.id):
                     continue
-                
-                # Сравнение заголовков и содержимого
-                title_sim = calculate_similarity(article1.title, article2.title)
-                content_sim = calculate_similarity(
-                    article1.content or '', 
-                    article2.content or ''
-                )
-                
-                # Если схожесть высокая, считаем дубликатом
-                if title_sim >= threshold or (title_sim >= 0.7 and content_sim >= threshold):
-                    # Берем более раннюю статью как оригинал
-                    if article1.published_at and article2.published_at:
-                        if article1.published_at < article2.published_at:
-                            duplicates[article2.id] = article1.id
-                        else:
-                            duplicates[article1.id] = article2.id
-                    else:
-                        duplicates[article2.id] = article1.id
-                    
+            
+                if is_near_duplicate(article1, article2, threshold):
+                    clusters.union(article1.id, article2.id)
+        
+        # Проверка по смыслу: перефразированные статьи с близкими embeddings.
+        # Необязательный этап: при ошибке остаются дубликаты, найденные по ссылке, хешу и тексту
+        if dedup_method == 'embedding':
+            try:
+                embedding_pairs = find_embedding_pairs(articles, search_history_id=search_history_id)
+            except Exception as e:
+                print(f"Ошибка при поиске дубликатов по embeddings: {e}")
+                embedding_pairs = []
+            for i, j in embedding_pairs:
+                clusters.union(articles[i].id, articles[j].id)
+        
+        # Уже обработанные статьи (вне списка) сохраняют оригинал своего кластера
+        external_ids = [key for key in clusters if key not in articles_by_id]
+        external_originals = {}
+        for chunk in iter_chunks(external_ids):
+            for article_id, duplicate_of in session.query(NewsArticle.id, NewsArticle.duplicate_of).filter(
+                NewsArticle.id.in_(chunk)
+            ):
+                external_originals[article_id] = duplicate_of or article_id
+        
+        for members in clusters.groups().values():
+            if len(members) < 2:
+                continue
+            originals = [external_originals.get(key, key) for key in members if key not in articles_by_id]
+            if originals:
+                original_id = min(originals)
+            else:
+                original_id = min((articles_by_id[key] for key in members), key=_original_sort_key).id
+            for key in members:
+                if key in articles_by_id and key != original_id:
+                    duplicates[key] = original_id
+    
     finally:
         session.close()
     
@@ -81,20 +327,76 @@ def find_duplicates(articles: List[NewsArticle], threshold: float = None, search
 
 
 def mark_duplicates(articles: List[NewsArticle], duplicates: dict):
-    """Пометка дубликатов в базе данных"""
+    """Пометка дубликатов и сохранение кластеров в базе данных
+    
+    Кластер определяется оригиналом: если у оригинала уже есть кластер
+    (например, из прошлой обработки), новые дубликаты добавляются в него,
+    иначе создается новый кластер. Все обновления - пакетные UPDATE по ID.
+    Возвращает количество затронутых кластеров.
+    """
+    if not duplicates:
+        return 0
+    
     session = get_db_session()
     
     try:
+        members_by_original = {}
         for article_id, original_id in duplicates.items():
-            article = session.query(NewsArticle).filter_by(id=article_id).first()
-            if article:
-                article.is_duplicate = True
-                article.duplicate_of = original_id
+            members_by_original.setdefault(original_id, []).append(article_id)
+        
+        # Текущие кластеры оригиналов
+        original_ids = list(members_by_original)
+        originals = {}
+        for chunk in iter_chunks(original_ids):
+            for article_id, cluster_id, history_id in session.query(
+                NewsArticle.id, NewsArticle.cluster_id, NewsArticle.search_history_id
+            ).filter(NewsArticle.id.in_(chunk)):
+                originals[article_id] = (cluster_id, history_id)
+        
+        new_clusters = {}
+        for original_id in original_ids:
+            cluster_id, history_id = originals.get(original_id, (None, None))
+            if cluster_id is None and original_id in originals:
+                new_clusters[original_id] = DuplicateCluster(
+                    canonical_article_id=original_id,
+                    search_history_id=history_id,
+                    size=1
+                )
+        session.add_all(new_clusters.values())
+        session.flush()
+        
+        cluster_by_original = {original_id: cluster_id for original_id, (cluster_id, _) in originals.items()}
+        cluster_by_original.update({original_id: cluster.id for original_id, cluster in new_clusters.items()})
+        
+        # UPDATE уровня таблицы (executemany): удаленные к этому моменту статьи просто пропускаются
+        update_by_id(session, NewsArticle, [
+            {'id': original_id, 'cluster_id': cluster.id} for original_id, cluster in new_clusters.items()
+        ])
+        update_by_id(session, NewsArticle, [
+            {'id': article_id, 'duplicate_of': original_id, 'cluster_id': cluster_by_original.get(original_id)}
+            for article_id, original_id in duplicates.items()
+        ], is_duplicate=True)
+        
+        clusters_table = DuplicateCluster.__table__
+        size_updates = [
+            {'target_cluster_id': cluster_by_original[original_id], 'added': len(members)}
+            for original_id, members in members_by_original.items()
+            if cluster_by_original.get(original_id) is not None
+        ]
+        if size_updates:
+            session.execute(
+                update(clusters_table).where(clusters_table.c.id == bindparam('target_cluster_id')).values(
+                    size=clusters_table.c.size + bindparam('added'),
+                    updated_at=datetime.utcnow()
+                ),
+                size_updates
+            )
         
         session.commit()
+        return len(size_updates)
     except Exception as e:
         session.rollback()
         print(f"Ошибка при пометке дубликатов: {e}")
+        return 0
     finally:
         session.close()
-
@@ -2,6 +2,9 @@
 from config import Config
 from models import NewsArticle
 import requests
+from agents.rate_limiter import post_with_rate_limit, estimate_tokens
+from agents.llm_utils import get_http_session
+from agents.db_utils import iter_chunks
 import json
 import numpy as np
 from typing import List, Optional
@@ -54,7 +57,8 @@ def generate_embedding_with_openai(text: str, model: str = "text-embedding-3-sma
     }
     
     try:
-        response = requests.post(api_url, headers=headers, json=payload, timeout=60 if is_ollama else 30)
+        response = post_with_rate_limit(api_url, model, estimate_tokens(text), kind='embeddings',
+                                        headers=headers, json=payload, timeout=60 if is_ollama else 30)
         response.raise_for_status()
         data = response.json()
         
@@ -93,7 +97,7 @@ def _try_ollama_native_api(text: str, model: str) -> Optional[List[float]]:
             'model': model,
             'prompt': text
         }
-        response = requests.post(ollama_url, json=payload, timeout=60)
+        response = get_http_session(ollama_url).post(ollama_url, json=payload, timeout=60)
         response.raise_for_status()
         data = response.json()
         
@@ -186,6 +190,72 @@ def cosine_similarity(embedding1: List[float], embedding2: List[float]) -> float
         return 0.0
 
 
+def normalize_embeddings(embeddings: List[Optional[List[float]]]) -> tuple:
+    """Матрица нормированных embeddings (float32) и индексы исходного списка для ее строк
+    
+    Пропускаются пустые векторы, векторы нулевой длины и векторы другой
+    размерности (например, посчитанные прежней моделью).
+    """
+    dimensions = {}
+    for embedding in embeddings:
+        if embedding:
+            dimensions[len(embedding)] = dimensions.get(len(embedding), 0) + 1
+    if not dimensions:
+        return np.zeros((0, 0), dtype=np.float32), []
+    dimension = max(dimensions, key=dimensions.get)
+    
+    indexes = [i for i, embedding in enumerate(embeddings) if embedding and len(embedding) == dimension]
+    matrix = np.array([embeddings[i] for i in indexes], dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1)
+    nonzero = norms > 0
+    matrix = matrix[nonzero] / norms[nonzero][:, None]
+    return matrix, [index for index, keep in zip(indexes, nonzero) if keep]
+
+
+def find_similar_pairs(matrix: np.ndarray, threshold: float, block_size: int = 1024) -> List[tuple]:
+    """Пары строк (i, j), i < j, нормированной матрицы с косинусным сходством не ниже порога
+    
+    Матрица сходства считается блоками по block_size строк (только верхний
+    треугольник), поэтому память ограничена block_size * n значениями.
+    """
+    pairs = []
+    count = matrix.shape[0]
+    for start in range(0, count, block_size):
+        end = min(start + block_size, count)
+        similarities = matrix[start:end] @ matrix[start:].T
+        rows, columns = np.nonzero(similarities >= threshold)
+        for row, column in zip(rows.tolist(), columns.tolist()):
+            i = start + row
+            j = start + column
+            if i < j:
+                pairs.append((i, j))
+    pairs.sort()
+    return pairs
+
+
+def load_embeddings(article_ids: List[int]) -> dict:
+    """Embeddings статей из БД {ID статьи: вектор} (статьи без embedding пропускаются)"""
+    from models import get_db_session
+    
+    result = {}
+    session = get_db_session()
+    try:
+        for chunk in iter_chunks(article_ids):
+            for article_id, embedding in session.query(NewsArticle.id, NewsArticle.embedding).filter(
+                NewsArticle.id.in_(chunk)
+            ):
+                if isinstance(embedding, str):
+                    try:
+                        embedding = json.loads(embedding)
+                    except (json.JSONDecodeError, TypeError):
+                        continue
+                if embedding:
+                    result[article_id] = embedding
+    finally:
+        session.close()
+    return result
+
+
 def find_similar_articles(query_embedding: List[float], articles: List[NewsArticle], 
                          threshold: float = 0.7, limit: int = 10) -> List[tuple]:
     """Поиск похожих статей по embedding"""
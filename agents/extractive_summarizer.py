@@ -0,0 +1,105 @@
+"""Локальное экстрактивное саммари (TextRank) без обращения к LLM
+
+Текст статьи разбивается на предложения, для предложений строятся TF-IDF
+векторы (IDF считается по предложениям самой статьи), матрица косинусного
+сходства считается одним матричным умножением NumPy, а важность
+предложений - степенным методом PageRank по этой матрице. В саммари
+попадают самые важные предложения в исходном порядке.
+"""
+import re
+from typing import List
+
+import numpy as np
+
+from config import Config
+from models import NewsArticle
+from agents.summarizer import clean_html, generate_simple_summary
+
+# Коэффициент затухания и параметры сходимости PageRank
+DAMPING = 0.85
+MAX_ITERATIONS = 50
+TOLERANCE = 1e-6
+# Предложения короче этого количества символов не рассматриваются
+MIN_SENTENCE_LENGTH = 20
+# Максимальное количество предложений текста, участвующих в ранжировании
+MAX_SENTENCES = 200
+
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?…])\s+(?=["«(\[]?[A-ZА-ЯЁ0-9])')
+_WORD_RE = re.compile(r'\w+')
+
+
+def split_sentences(text: str) -> List[str]:
+    """Разбиение текста на предложения (по знакам конца предложения перед заглавной буквой)"""
+    text = re.sub(r'\s+', ' ', text or '').strip()
+    if not text:
+        return []
+    return [sentence.strip() for sentence in _SENTENCE_SPLIT_RE.split(text) if sentence.strip()]
+
+
+def _tfidf_matrix(sentences: List[str]) -> np.ndarray:
+    """Нормированные TF-IDF векторы предложений (строки матрицы)"""
+    tokenized = [[word for word in _WORD_RE.findall(sentence.lower()) if len(word) >= 3] for sentence in sentences]
+    vocabulary = {}
+    for words in tokenized:
+        for word in words:
+            vocabulary.setdefault(word, len(vocabulary))
+    
+    counts = np.zeros((len(sentences), max(1, len(vocabulary))), dtype=np.float32)
+    for row, words in enumerate(tokenized):
+        for word in words:
+            counts[row, vocabulary[word]] += 1
+    
+    document_frequency = np.count_nonzero(counts, axis=0)
+    idf = np.log((1 + len(sentences)) / (1 + document_frequency)) + 1
+    matrix = counts * idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def rank_sentences(sentences: List[str]) -> np.ndarray:
+    """Оценки важности предложений (TextRank)"""
+    count = len(sentences)
+    if count == 0:
+        return np.zeros(0, dtype=np.float32)
+    
+    matrix = _tfidf_matrix(sentences)
+    similarity = matrix @ matrix.T
+    np.fill_diagonal(similarity, 0)
+    
+    # Переходная матрица: предложение без похожих равномерно "раздает" вес всем
+    row_sums = similarity.sum(axis=1, keepdims=True)
+    transition = np.where(row_sums > 0, similarity / np.where(row_sums > 0, row_sums, 1), 1.0 / count)
+    
+    scores = np.full(count, 1.0 / count, dtype=np.float32)
+    for _ in range(MAX_ITERATIONS):
+        updated = (1 - DAMPING) / count + DAMPING * (transition.T @ scores)
+        if np.abs(updated - scores).sum() < TOLERANCE:
+            scores = updated
+            break
+        scores = updated
+    return scores
+
+
+def summarize_text(text: str, sentence_count: int = None) -> str:
+    """Экстрактивное саммари текста из sentence_count самых важных предложений"""
+    if sentence_count is None:
+        sentence_count = Config.SUMMARY_EXTRACTIVE_SENTENCES
+    
+    sentences = [sentence for sentence in split_sentences(text) if len(sentence) >= MIN_SENTENCE_LENGTH]
+    sentences = sentences[:MAX_SENTENCES]
+    if len(sentences) <= sentence_count:
+        return ' '.join(sentences)
+    
+    scores = rank_sentences(sentences)
+    # При равных оценках предпочтение более ранним предложениям
+    top = sorted(np.argsort(-scores, kind='stable')[:sentence_count].tolist())
+    return ' '.join(sentences[index] for index in top)
+
+
+def generate_extractive_summary(article: NewsArticle, sentence_count: int = None) -> str:
+    """Экстрактивное саммари статьи (простое саммари, если в тексте нет подходящих предложений)"""
+    summary = summarize_text(clean_html(article.content or ''), sentence_count)
+    if summary:
+        return summary
+    return generate_simple_summary(article)
@@ -0,0 +1,147 @@
+"""Загрузка RSS каналов с таймаутами и ограничением размера ответа"""
+import time
+import hashlib
+import requests
+import feedparser
+from config import Config
+
+# Итоговые статусы загрузки канала
+FETCH_OK = 'ok'
+FETCH_TIMEOUT = 'timeout'
+FETCH_TOO_LARGE = 'too_large'
+FETCH_PARSE_ERROR = 'parse_error'
+FETCH_HTTP_ERROR = 'http_error'
+FETCH_ERROR = 'error'
+# Канал не изменился с прошлой загрузки (304 или тот же хеш тела) - статьи не разбираются
+FETCH_NOT_MODIFIED = 'not_modified'
+FETCH_UNCHANGED = 'unchanged'
+
+# Статусы, при которых канал считается успешно опрошенным
+FETCH_SUCCESS_STATUSES = (FETCH_OK, FETCH_NOT_MODIFIED, FETCH_UNCHANGED)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _iter_response_body(response):
+    """Чтение тела ответа порциями по мере поступления данных
+    
+    read1 (urllib3 2.x) возвращает уже полученные байты, не дожидаясь заполнения
+    всей порции, поэтому общий дедлайн проверяется даже при медленной отдаче.
+    """
+    raw = response.raw
+    if not hasattr(raw, 'read1'):
+        yield from response.iter_content(chunk_size=CHUNK_SIZE)
+        return
+    while True:
+        chunk = raw.read1(CHUNK_SIZE, decode_content=True)
+        if not chunk:
+            break
+        yield chunk
+
+
+def fetch_feed(feed_url: str, connect_timeout: float = None, read_timeout: float = None,
+               total_timeout: float = None, max_bytes: int = None, etag: str = None,
+               last_modified: str = None, body_hash: str = None) -> dict:
+    """Загрузка и парсинг одного RSS канала
+    
+    Никогда не выбрасывает исключений: результат всегда содержит статус загрузки
+    (`ok`, `not_modified`, `unchanged`, `timeout`, `too_large`, `parse_error`,
+    `http_error`, `error`) и, при статусе `ok`, распарсенный канал в поле `feed`.
+    etag / last_modified / body_hash - сохраненные с прошлой загрузки значения
+    для условного запроса; новые значения возвращаются в одноименных полях результата.
+    """
+    if connect_timeout is None:
+        connect_timeout = Config.RSS_FETCH_CONNECT_TIMEOUT
+    if read_timeout is None:
+        read_timeout = Config.RSS_FETCH_READ_TIMEOUT
+    if total_timeout is None:
+        total_timeout = Config.RSS_FETCH_TOTAL_TIMEOUT
+    if max_bytes is None:
+        max_bytes = Config.RSS_FETCH_MAX_BYTES
+    
+    result = {
+        'url': feed_url,
+        'status': FETCH_OK,
+        'http_status': None,
+        'bytes': 0,
+        'elapsed': 0.0,
+        'entries': 0,
+        'error': '',
+        'etag': etag,
+        'last_modified': last_modified,
+        'body_hash': body_hash,
+        'feed': None
+    }
+    started = time.monotonic()
+    
+    try:
+        headers = {'User-Agent': feedparser.USER_AGENT}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        
+        with requests.get(feed_url, headers=headers, stream=True,
+                          timeout=(connect_timeout, read_timeout)) as response:
+            result['http_status'] = response.status_code
+            if response.status_code == 304:
+                result['status'] = FETCH_NOT_MODIFIED
+                return result
+            if response.status_code >= 400:
+                result['status'] = FETCH_HTTP_ERROR
+                result['error'] = f'HTTP {response.status_code}'
+                return result
+            
+            # Отсекаем заведомо большие ответы до начала загрузки
+            content_length = response.headers.get('Content-Length')
+            if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                result['status'] = FETCH_TOO_LARGE
+                result['error'] = f'Content-Length {content_length} > {max_bytes}'
+                return result
+            
+            chunks = []
+            for chunk in _iter_response_body(response):
+                result['bytes'] += len(chunk)
+                if result['bytes'] > max_bytes:
+                    result['status'] = FETCH_TOO_LARGE
+                    result['error'] = f'Размер ответа превысил {max_bytes} байт'
+                    return result
+                # read timeout ограничивает паузу между пакетами, а не всю загрузку
+                if time.monotonic() - started > total_timeout:
+                    result['status'] = FETCH_TIMEOUT
+                    result['error'] = f'Загрузка не уложилась в {total_timeout} с'
+                    return result
+                chunks.append(chunk)
+            
+            body = b''.join(chunks)
+            response_headers = {key.lower(): value for key, value in response.headers.items()}
+            response_headers.setdefault('content-location', response.url)
+        
+        result['etag'] = response_headers.get('etag')
+        result['last_modified'] = response_headers.get('last-modified')
+        new_body_hash = hashlib.sha256(body).hexdigest()
+        if body_hash and new_body_hash == body_hash:
+            # Сервер не поддерживает условные запросы, но содержимое то же самое
+            result['status'] = FETCH_UNCHANGED
+            return result
+        result['body_hash'] = new_body_hash
+        
+        feed = feedparser.parse(body, response_headers=response_headers)
+        if feed.get('bozo') and not feed.entries:
+            result['status'] = FETCH_PARSE_ERROR
+            result['error'] = str(feed.get('bozo_exception', 'Некорректный формат канала'))
+            return result
+        
+        result['feed'] = feed
+        result['entries'] = len(feed.entries)
+        return result
+    except requests.exceptions.Timeout as e:
+        result['status'] = FETCH_TIMEOUT
+        result['error'] = str(e)
+        return result
+    except Exception as e:
+        result['status'] = FETCH_ERROR
+        result['error'] = str(e)
+        return result
+    finally:
+        result['elapsed'] = round(time.monotonic() - started, 3)
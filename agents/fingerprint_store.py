@@ -0,0 +1,168 @@
+"""Хранилище отпечатков статей для поиска похожих статей между запросами
+
+Для каждой уникальной статьи запроса сохраняется MinHash сигнатура заголовка
+и корзины ее LSH полос. Новая статья, похожая на статью прошлого запроса,
+связывается с ней (`reused_from`) и получает ее результаты обработки без
+повторных обращений к LLM и API embeddings.
+"""
+from config import Config
+from models import NewsArticle, SearchHistory, ArticleFingerprint, ArticleFingerprintBand, get_db_session
+from agents.minhash import MinHasher, LSHIndex, get_shingles
+from agents.deduplicator import is_near_duplicate
+from agents.classification_cache import normalize_criteria
+from agents.db_utils import iter_chunks
+from sqlalchemy import tuple_
+import numpy as np
+
+
+def _get_band_buckets(index: LSHIndex, signature: np.ndarray) -> list:
+    """Пары (band, bucket) сигнатуры для записи в БД"""
+    return [(band, band_key.hex()) for band, band_key in enumerate(index.band_keys(signature))]
+
+
+def _empty_stats() -> dict:
+    """Статистика переиспользования без найденных совпадений"""
+    return {'matched': 0, 'reused_scores': 0, 'reused_summaries': 0, 'reused_embeddings': 0, 'article_ids': []}
+
+
+def find_previous_candidates(session, buckets_by_article: dict, search_history_id: int) -> dict:
+    """ID статей прошлых запросов, совпавших с каждой статьей хотя бы в одной полосе"""
+    articles_by_bucket = {}
+    for article_id, buckets in buckets_by_article.items():
+        for bucket in buckets:
+            articles_by_bucket.setdefault(bucket, []).append(article_id)
+    
+    all_buckets = list(articles_by_bucket)
+    candidates = {article_id: set() for article_id in buckets_by_article}
+    for chunk in iter_chunks(all_buckets):
+        query = session.query(
+            ArticleFingerprintBand.article_id, ArticleFingerprintBand.band, ArticleFingerprintBand.bucket
+        ).join(
+            NewsArticle, NewsArticle.id == ArticleFingerprintBand.article_id
+        ).filter(
+            tuple_(ArticleFingerprintBand.band, ArticleFingerprintBand.bucket).in_(chunk)
+        )
+        if search_history_id is not None:
+            query = query.filter(
+                (NewsArticle.search_history_id != search_history_id) | (NewsArticle.search_history_id == None)
+            )
+        for previous_id, band, bucket in query:
+            for article_id in articles_by_bucket.get((band, bucket), ()):
+                candidates[article_id].add(previous_id)
+    return candidates
+
+
+def link_previous_articles(search_history_id: int, criteria: str, relevance_threshold: float = None,
+                           similarity_threshold: float = None) -> dict:
+    """Связывание уникальных статей запроса с похожими статьями прошлых запросов
+    
+    Похожесть определяется тем же правилом, что и при дедупликации. Оценка
+    релевантности переиспользуется, только если критерий отбора совпадает
+    (is_relevant пересчитывается по текущему порогу); саммари и embedding
+    от критерия не зависят и переносятся всегда, если уже были получены.
+    Для всех уникальных статей запроса сохраняются отпечатки.
+    Возвращает статистику и ID связанных статей (`article_ids`).
+    """
+    if relevance_threshold is None:
+        relevance_threshold = Config.RELEVANCE_THRESHOLD
+    if similarity_threshold is None:
+        similarity_threshold = Config.SIMILARITY_THRESHOLD
+    
+    stats = _empty_stats()
+    hasher = MinHasher(Config.DEDUP_LSH_BANDS * Config.DEDUP_LSH_ROWS)
+    index = LSHIndex(Config.DEDUP_LSH_BANDS, Config.DEDUP_LSH_ROWS)
+    
+    session = get_db_session()
+    try:
+        articles = session.query(NewsArticle).outerjoin(
+            ArticleFingerprint, ArticleFingerprint.article_id == NewsArticle.id
+        ).filter(
+            NewsArticle.search_history_id == search_history_id,
+            NewsArticle.is_duplicate == False,
+            ArticleFingerprint.article_id == None
+        ).order_by(NewsArticle.id).all()
+        if not articles:
+            return stats
+        
+        signatures = {}
+        buckets_by_article = {}
+        for article in articles:
+            shingles = get_shingles(article.title)
+            if not shingles:
+                continue
+            signatures[article.id] = hasher.signature(shingles)
+            buckets_by_article[article.id] = _get_band_buckets(index, signatures[article.id])
+        
+        candidates = find_previous_candidates(session, buckets_by_article, search_history_id)
+        previous_ids = set().union(*candidates.values()) if candidates else set()
+        previous_articles = {}
+        criteria_by_history = {}
+        if previous_ids:
+            previous_ids = list(previous_ids)
+            for chunk in iter_chunks(previous_ids):
+                for previous in session.query(NewsArticle).filter(NewsArticle.id.in_(chunk)):
+                    previous_articles[previous.id] = previous
+            history_ids = {previous.search_history_id for previous in previous_articles.values()}
+            for history_id, history_criteria in session.query(SearchHistory.id, SearchHistory.selection_criteria).filter(
+                SearchHistory.id.in_([history_id for history_id in history_ids if history_id is not None])
+            ):
+                criteria_by_history[history_id] = normalize_criteria(history_criteria)
+        
+        # Критерии сравниваются так же, как в кэше классификации (без учета регистра и пробелов)
+        criteria = normalize_criteria(criteria)
+        
+        def candidate_order(previous):
+            # Сначала статьи с тем же критерием и уже посчитанной оценкой, затем самые свежие
+            same_criteria = criteria_by_history.get(previous.search_history_id) == criteria
+            return (same_criteria and previous.relevance_score is not None, previous.id)
+        
+        for article in articles:
+            if article.id not in signatures:
+                continue
+            
+            matched = None
+            for previous in sorted(
+                (previous_articles[previous_id] for previous_id in candidates.get(article.id, ()) if previous_id in previous_articles),
+                key=candidate_order,
+                reverse=True
+            ):
+                if is_near_duplicate(article, previous, similarity_threshold):
+                    matched = previous
+                    break
+            
+            if matched is not None:
+                article.reused_from = matched.id
+                stats['matched'] += 1
+                stats['article_ids'].append(article.id)
+                if criteria_by_history.get(matched.search_history_id) == criteria and matched.relevance_score is not None:
+                    article.relevance_score = matched.relevance_score
+                    article.is_relevant = matched.relevance_score >= relevance_threshold
+                    article.classification_reason = matched.classification_reason
+                    stats['reused_scores'] += 1
+                if matched.summary and not article.summary:
+                    article.summary = matched.summary
+                    stats['reused_summaries'] += 1
+                if matched.embedding and not article.embedding:
+                    article.embedding = matched.embedding
+                    stats['reused_embeddings'] += 1
+            
+            session.add(ArticleFingerprint(article_id=article.id, signature=signatures[article.id].tobytes()))
+            session.add_all([
+                ArticleFingerprintBand(article_id=article.id, band=band, bucket=bucket)
+                for band, bucket in buckets_by_article[article.id]
+            ])
+        
+        session.commit()
+        return stats
+    except Exception as e:
+        session.rollback()
+        print(f"Ошибка при поиске статей прошлых запросов: {e}")
+        return _empty_stats()
+    finally:
+        session.close()
+
+
+def delete_all_fingerprints(session):
+    """Удаление всех отпечатков (при массовом удалении статей в обход ORM каскада)"""
+    session.query(ArticleFingerprintBand).delete(synchronize_session=False)
+    session.query(ArticleFingerprint).delete(synchronize_session=False)
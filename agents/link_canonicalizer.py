@@ -0,0 +1,111 @@
+"""Приведение ссылок на статьи к каноническому виду
+
+Одна и та же новость часто приходит с разными utm-метками, по http и https,
+с завершающим слэшем или в AMP-версии. Каноническая ссылка используется для
+проверки существования статьи и поиска точных дубликатов.
+"""
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from config import Config
+
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+
+def get_default_rules() -> dict:
+    """Правила нормализации из конфигурации"""
+    return {
+        'tracking_params': Config.LINK_TRACKING_PARAMS,
+        'force_https': Config.LINK_FORCE_HTTPS,
+        'strip_www': Config.LINK_STRIP_WWW,
+        'strip_amp': Config.LINK_STRIP_AMP,
+        'strip_trailing_slash': Config.LINK_STRIP_TRAILING_SLASH
+    }
+
+
+def _is_tracking_param(name: str, tracking_params: list) -> bool:
+    """Проверка параметра запроса по списку (шаблон `utm_*` задает префикс)"""
+    name = name.lower()
+    for pattern in tracking_params:
+        if pattern.endswith('*'):
+            if name.startswith(pattern[:-1]):
+                return True
+        elif name == pattern:
+            return True
+    return False
+
+
+def _strip_amp_path(path: str) -> str:
+    """Удаление AMP-признаков из пути: завершающий сегмент /amp, префикс /amp/, .amp.html
+    
+    Сегменты amp в середине пути (/tags/amp/page2) не трогаются - это обычная
+    часть адреса, и ее удаление склеило бы разные статьи.
+    """
+    lowered = path.lower()
+    if lowered.endswith('/amp/'):
+        path = path[:-len('/amp/')] or '/'
+    elif lowered.endswith('/amp'):
+        path = path[:-len('/amp')] or '/'
+    if path.lower().startswith('/amp/'):
+        path = path[len('/amp'):]
+    if path.lower().endswith('.amp.html'):
+        path = path[:-len('.amp.html')] + '.html'
+    elif path.lower().endswith('.amp'):
+        path = path[:-len('.amp')]
+    return path
+
+
+def canonicalize_link(link: str, rules: dict = None) -> str:
+    """Каноническая форма ссылки
+    
+    Схема и хост приводятся к нижнему регистру, удаляются порт по умолчанию,
+    якорь и параметры отслеживания, оставшиеся параметры сортируются.
+    Остальные шаги (https, www, AMP, завершающий слэш) задаются правилами.
+    Ссылки без схемы и хоста возвращаются без изменений.
+    """
+    if not link:
+        return link
+    if rules is None:
+        rules = get_default_rules()
+    
+    try:
+        parts = urlsplit(link.strip())
+        port = parts.port
+    except ValueError:
+        return link.strip()
+    if not parts.scheme or not parts.netloc:
+        return link.strip()
+    
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    # Порт по умолчанию определяется по исходной схеме (http://host:80 -> https://host)
+    if port is not None and str(port) == DEFAULT_PORTS.get(scheme):
+        port = None
+    
+    if rules.get('force_https') and scheme == 'http':
+        scheme = 'https'
+    if rules.get('strip_www') and host.startswith('www.'):
+        host = host[len('www.'):]
+    
+    path = parts.path or '/'
+    if rules.get('strip_amp'):
+        if host.startswith('amp.'):
+            host = host[len('amp.'):]
+        path = _strip_amp_path(path)
+    if rules.get('strip_trailing_slash') and len(path) > 1:
+        path = path.rstrip('/') or '/'
+    
+    # IPv6 адрес в netloc записывается в квадратных скобках
+    netloc = f"[{host}]" if ':' in host else host
+    if port is not None and str(port) != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+    
+    tracking_params = [param.lower() for param in rules.get('tracking_params') or []]
+    query_params = []
+    for name, value in parse_qsl(parts.query, keep_blank_values=True):
+        if _is_tracking_param(name, tracking_params):
+            continue
+        if rules.get('strip_amp') and (name.lower() == 'amp' or (name.lower() == 'outputtype' and value.lower() == 'amp')):
+            continue
+        query_params.append((name, value))
+    query = urlencode(sorted(query_params))
+    
+    return urlunsplit((scheme, netloc, path, query, ''))
@@ -1,39 +1,80 @@
-"""Утилиты для работы с LLM"""
+"""Утилиты для работы с LLM
+
+Клиенты LLM и HTTP сессии переиспользуются между вызовами: ChatOpenAI
+кэшируется по (base_url, модель, temperature), а для каждого хоста API
+держится одна requests.Session с пулом keep-alive соединений, поэтому
+TCP и TLS соединение не устанавливается заново для каждой статьи.
+"""
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
 from langchain_openai import ChatOpenAI
 from config import Config
 
+_clients = {}
+_sessions = {}
+_registry_lock = threading.Lock()
+
 
 def create_llm():
     """Создание LLM с правильной обработкой base_url (использует настройки из Config)"""
     return create_llm_with_settings(Config.LLM_MODEL, Config.LLM_TEMPERATURE)
 
 
+def _get_langchain_base_url() -> str:
+    """base_url для ChatOpenAI по OPENAI_API_BASE (None - стандартный OpenAI endpoint)"""
+    if not Config.OPENAI_API_BASE:
+        return None
+    base_url = Config.OPENAI_API_BASE.rstrip('/')
+    
+    # Для ChatOpenAI из langchain-openai base_url должен указывать на базовый URL API
+    # без /v1, так как библиотека сама добавляет /v1/chat/completions
+    # Убираем /v1 если он есть в конце URL (может быть /openai/v1 или просто /v1)
+    if base_url.endswith('/v1'):
+        # Убираем /v1 с конца
+        base_url = base_url[:-3].rstrip('/')
+    return base_url
+
+
 def create_llm_with_settings(llm_model: str = None, llm_temperature: float = None):
-    """Создание LLM с указанными настройками"""
+    """LLM с указанными настройками (общий клиент для одинаковых (base_url, модель, temperature))"""
     if llm_model is None:
         llm_model = Config.LLM_MODEL
     if llm_temperature is None:
         llm_temperature = Config.LLM_TEMPERATURE
     
-    llm_params = {
-        'model': llm_model,
-        'temperature': llm_temperature,
-        'api_key': Config.OPENAI_API_KEY
-    }
-    
-    # Правильная обработка base_url для ChatOpenAI
-    if Config.OPENAI_API_BASE:
-        base_url = Config.OPENAI_API_BASE.rstrip('/')
-        
-        # Для ChatOpenAI из langchain-openai base_url должен указывать на базовый URL API
-        # без /v1, так как библиотека сама добавляет /v1/chat/completions
-        # Убираем /v1 если он есть в конце URL (может быть /openai/v1 или просто /v1)
-        if base_url.endswith('/v1'):
-            # Убираем /v1 с конца
-            base_url = base_url[:-3].rstrip('/')
-        
-        llm_params['base_url'] = base_url
-        print(f"Используется base_url: {base_url} (исходный: {Config.OPENAI_API_BASE})")
-    
-    return ChatOpenAI(**llm_params)
+    base_url = _get_langchain_base_url()
+    key = (base_url, llm_model, float(llm_temperature))
+    with _registry_lock:
+        llm = _clients.get(key)
+        if llm is None:
+            llm_params = {
+                'model': llm_model,
+                'temperature': llm_temperature,
+                'api_key': Config.OPENAI_API_KEY
+            }
+            # Правильная обработка base_url для ChatOpenAI
+            if base_url:
+                llm_params['base_url'] = base_url
+                print(f"Используется base_url: {base_url} (исходный: {Config.OPENAI_API_BASE})")
+            llm = ChatOpenAI(**llm_params)
+            _clients[key] = llm
+        return llm
+
+
+def get_http_session(url: str) -> requests.Session:
+    """Общая HTTP сессия с пулом keep-alive соединений для хоста url (потокобезопасно)"""
+    parts = urlsplit(url)
+    key = f"{parts.scheme}://{parts.netloc}"
+    with _registry_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, Config.LLM_HTTP_POOL_SIZE))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+        return session
 
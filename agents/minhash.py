@@ -0,0 +1,101 @@
+"""MinHash сигнатуры и LSH индекс для поиска кандидатов в дубликаты
+
+Вместо сравнения каждой пары статей заголовок разбивается на символьные
+шинглы, по ним строится MinHash сигнатура, а сигнатура делится на полосы
+(bands). Статьи, у которых совпала хотя бы одна полоса, становятся парой
+кандидатов - только такие пары проверяются точным сравнением текста.
+"""
+import zlib
+import numpy as np
+from typing import List, Iterable
+
+# Простое число Мерсенна 2^31 - 1: произведение a * x помещается в uint64
+MERSENNE_PRIME = (1 << 31) - 1
+MAX_HASH = MERSENNE_PRIME
+
+DEFAULT_SHINGLE_SIZE = 3
+DEFAULT_SEED = 1
+
+
+def get_shingles(text: str, size: int = DEFAULT_SHINGLE_SIZE) -> set:
+    """Множество хешей символьных шинглов текста (пустое для пустого текста)"""
+    text = ' '.join((text or '').lower().split())
+    if not text:
+        return set()
+    if len(text) <= size:
+        return {zlib.crc32(text.encode('utf-8'))}
+    return {zlib.crc32(text[i:i + size].encode('utf-8')) for i in range(len(text) - size + 1)}
+
+
+class MinHasher:
+    """Вычисление MinHash сигнатур фиксированной длины
+
+    Коэффициенты хеш-функций определяются seed, поэтому сигнатуры,
+    посчитанные в разных процессах и запусках, сравнимы между собой.
+    """
+
+    def __init__(self, num_perm: int, seed: int = DEFAULT_SEED):
+        self.num_perm = num_perm
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingles: Iterable[int]) -> np.ndarray:
+        """Сигнатура множества шинглов (для пустого множества - все значения MAX_HASH)"""
+        values = np.fromiter(shingles, dtype=np.uint64)
+        if values.size == 0:
+            return np.full(self.num_perm, MAX_HASH, dtype=np.uint64)
+        values %= np.uint64(MERSENNE_PRIME)
+        hashes = (np.outer(self._a, values) + self._b[:, None]) % np.uint64(MERSENNE_PRIME)
+        return hashes.min(axis=1)
+
+
+def estimate_jaccard(signature1: np.ndarray, signature2: np.ndarray) -> float:
+    """Оценка коэффициента Жаккара по двум сигнатурам"""
+    return float(np.mean(signature1 == signature2))
+
+
+class LSHIndex:
+    """LSH индекс по полосам MinHash сигнатуры
+
+    Сигнатура длиной bands * rows делится на bands полос по rows значений;
+    вероятность того, что пара с похожестью s станет кандидатом,
+    равна 1 - (1 - s^rows)^bands.
+    """
+
+    def __init__(self, bands: int, rows: int):
+        self.bands = bands
+        self.rows = rows
+        self._buckets = [dict() for _ in range(bands)]
+
+    def band_keys(self, signature: np.ndarray) -> List[bytes]:
+        """Ключи корзин сигнатуры для каждой полосы"""
+        return [
+            signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
+
+    def add(self, key, signature: np.ndarray):
+        """Добавление сигнатуры в индекс под ключом key"""
+        for buckets, band_key in zip(self._buckets, self.band_keys(signature)):
+            buckets.setdefault(band_key, []).append(key)
+
+    def query(self, signature: np.ndarray) -> set:
+        """Ключи, совпавшие с сигнатурой хотя бы в одной полосе"""
+        result = set()
+        for buckets, band_key in zip(self._buckets, self.band_keys(signature)):
+            result.update(buckets.get(band_key, ()))
+        return result
+
+    def candidate_pairs(self) -> set:
+        """Все пары ключей (key1 < key2), попавшие в одну корзину хотя бы одной полосы"""
+        pairs = set()
+        for buckets in self._buckets:
+            for keys in buckets.values():
+                if len(keys) < 2:
+                    continue
+                keys = sorted(keys)
+                for i, key1 in enumerate(keys):
+                    for key2 in keys[i + 1:]:
+                        pairs.add((key1, key2))
+        return pairs
@@ -0,0 +1,192 @@
+"""Ограничение частоты запросов к LLM и embeddings API
+
+Для каждой пары (endpoint, модель) ведутся два token bucket: запросов в минуту
+(RPM) и токенов в минуту (TPM). Перед запросом поток резервирует один запрос
+и оценку токенов и при необходимости ждет. Ответ 429 (и 503 с Retry-After)
+блокирует все запросы к этой паре на время из заголовка Retry-After или на
+время экспоненциальной задержки, после чего запрос повторяется.
+"""
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+
+from config import Config
+from agents.llm_utils import get_http_session
+
+# Статусы, при которых запрос повторяется после ожидания
+RETRY_STATUSES = (429, 503)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Token bucket с пополнением capacity единиц в минуту (резервирование в долг)"""
+    
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def reserve(self, amount: float, now: float) -> float:
+        """Резервирование amount единиц; возвращает время ожидания до их появления (секунды)"""
+        self._refill(now)
+        # Запрос больше емкости все равно должен пройти - ограничиваем его емкостью
+        amount = min(amount, self.capacity)
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+    
+    def adjust(self, amount: float, now: float):
+        """Поправка после ответа: amount > 0 - израсходовано больше оценки, < 0 - меньше"""
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RateLimiter:
+    """Ограничение RPM / TPM для одной пары (endpoint, модель); потокобезопасно"""
+    
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0):
+        self._lock = threading.Lock()
+        self._requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._blocked_until = 0.0
+    
+    @property
+    def tracks_tokens(self) -> bool:
+        """Задан ли лимит токенов в минуту"""
+        return self._tokens is not None
+    
+    def acquire(self, estimated_tokens: int = 0):
+        """Ожидание возможности отправить запрос с оценкой estimated_tokens токенов"""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._blocked_until - now)
+            if self._requests is not None:
+                wait = max(wait, self._requests.reserve(1, now))
+            if self._tokens is not None and estimated_tokens:
+                wait = max(wait, self._tokens.reserve(estimated_tokens, now))
+        if wait > 0:
+            time.sleep(wait)
+    
+    def record_usage(self, estimated_tokens: int, actual_tokens: int):
+        """Поправка TPM по фактическому расходу токенов из ответа API"""
+        if self._tokens is None or actual_tokens is None:
+            return
+        with self._lock:
+            self._tokens.adjust(actual_tokens - estimated_tokens, time.monotonic())
+    
+    def block_for(self, seconds: float):
+        """Блокировка всех запросов на seconds секунд (ответ 429 / Retry-After)"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+def get_rate_limiter(endpoint: str, model: str, kind: str = 'chat') -> RateLimiter:
+    """Общий ограничитель для пары (endpoint, модель); kind - chat или embeddings"""
+    key = (endpoint, model)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            if kind == 'embeddings':
+                limiter = RateLimiter(Config.EMBEDDING_RATE_LIMIT_RPM, Config.EMBEDDING_RATE_LIMIT_TPM)
+            else:
+                limiter = RateLimiter(Config.LLM_RATE_LIMIT_RPM, Config.LLM_RATE_LIMIT_TPM)
+            _limiters[key] = limiter
+        return limiter
+
+
+def chat_completions_url() -> str:
+    """URL chat completions для OPENAI_API_BASE (он же endpoint в ключе ограничителя)"""
+    if Config.OPENAI_API_BASE and Config.OPENAI_API_BASE.strip():
+        api_url = Config.OPENAI_API_BASE.rstrip('/')
+        if not api_url.endswith('/chat/completions'):
+            if api_url.endswith('/v1'):
+                api_url = f"{api_url}/chat/completions"
+            else:
+                api_url = f"{api_url}/v1/chat/completions"
+        return api_url
+    # Стандартный OpenAI endpoint
+    return "https://api.openai.com/v1/chat/completions"
+
+
+def acquire_chat_slot(model: str, prompt: str, max_output_tokens: int = 0):
+    """Ожидание лимита перед запросом к chat completions в обход post_with_rate_limit (langchain)"""
+    get_rate_limiter(chat_completions_url(), model).acquire(estimate_tokens(prompt, max_output_tokens))
+
+
+def estimate_tokens(text: str, max_output_tokens: int = 0) -> int:
+    """Грубая оценка количества токенов запроса (около 4 символов на токен) плюс ответ"""
+    return len(text or '') // 4 + 1 + (max_output_tokens or 0)
+
+
+def parse_retry_after(value: str):
+    """Секунды ожидания из заголовка Retry-After (число секунд или HTTP-дата); None, если не разобран"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def post_with_rate_limit(url: str, model: str, estimated_tokens: int = 0, kind: str = 'chat',
+                         max_retries: int = None, **kwargs) -> requests.Response:
+    """POST запрос через общую HTTP сессию с учетом лимитов RPM / TPM и повтором при 429
+    
+    Возвращает последний ответ; если повторы исчерпаны, вызывающий код
+    получит ответ 429 и обработает его как обычную HTTP ошибку.
+    """
+    if max_retries is None:
+        max_retries = Config.LLM_MAX_RETRIES
+    
+    limiter = get_rate_limiter(url, model, kind)
+    attempt = 0
+    while True:
+        limiter.acquire(estimated_tokens)
+        response = get_http_session(url).post(url, **kwargs)
+        
+        if response.status_code not in RETRY_STATUSES:
+            # Потоковый ответ не читаем: его разбирает вызывающий код
+            if response.ok and limiter.tracks_tokens and not kwargs.get('stream'):
+                try:
+                    usage = response.json().get('usage') or {}
+                    limiter.record_usage(estimated_tokens, usage.get('total_tokens'))
+                except ValueError:
+                    pass
+            return response
+        
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        # 503 без Retry-After - обычная ошибка сервера, не повторяем
+        if response.status_code != 429 and retry_after is None:
+            return response
+        if attempt >= max_retries:
+            print(f"Превышен лимит запросов к {url} (модель {model}), повторы исчерпаны")
+            return response
+        
+        if retry_after is None:
+            retry_after = min(Config.LLM_RETRY_MAX_WAIT, 2 ** attempt) + random.uniform(0, 1)
+        retry_after = min(retry_after, Config.LLM_RETRY_MAX_WAIT)
+        print(f"HTTP {response.status_code} от {url} (модель {model}), повтор через {retry_after:.1f} с")
+        # Потоковый ответ без закрытия удерживал бы соединение пула
+        response.close()
+        limiter.block_for(retry_after)
+        attempt += 1
@@ -1,10 +1,19 @@
 """Модуль для сбора новостей из RSS каналов"""
-import feedparser
-from datetime import datetime
+from datetime import datetime, timedelta
 from config import Config
 from models import NewsArticle, RSSFeed, get_db_session
+from agents.feed_fetcher import fetch_feed, FETCH_OK, FETCH_PARSE_ERROR, FETCH_SUCCESS_STATUSES
+from agents.link_canonicalizer import canonicalize_link
+from agents.db_utils import iter_chunks, rows_per_statement
+from sqlalchemy import or_
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import threading
 import hashlib
 
+# Максимальное количество запоминаемых GUID записей канала без даты
+SEEN_GUIDS_LIMIT = 1000
+
 
 def get_content_hash(title: str, content: str) -> str:
     """Генерация хеша для проверки дубликатов"""
@@ -12,34 +21,358 @@ def get_content_hash(title: str, content: str) -> str:
     return hashlib.sha256(text.encode('utf-8')).hexdigest()
 
 
-def collect_rss_news(feed_urls: list) -> list:
-    """Сбор новостей из RSS каналов"""
+def find_existing_links(session, links: list, search_history_id: int = None) -> set:
+    """Ссылки из списка, уже сохраненные в БД (один запрос IN на порцию ссылок)
+    
+    Ссылка считается существующей, если в БД есть статья с той же ссылкой или
+    с той же канонической ссылкой (например, отличающаяся только utm-метками).
+    Если указан search_history_id, проверка выполняется только в рамках этого запроса.
+    """
+    unique_links = list(dict.fromkeys(link for link in links if link is not None))
+    links_by_canonical = {}
+    for link in unique_links:
+        links_by_canonical.setdefault(canonicalize_link(link), []).append(link)
+    
+    existing = set()
+    for chunk in iter_chunks(unique_links):
+        canonical_chunk = list({canonicalize_link(link) for link in chunk})
+        query = session.query(NewsArticle.link, NewsArticle.canonical_link).filter(
+            or_(NewsArticle.link.in_(chunk), NewsArticle.canonical_link.in_(canonical_chunk))
+        )
+        if search_history_id is not None:
+            query = query.filter(NewsArticle.search_history_id == search_history_id)
+        for link, canonical_link in query:
+            existing.add(link)
+            existing.update(links_by_canonical.get(canonical_link, ()))
+    return existing
+
+
+def _article_to_row(article: NewsArticle, search_history_id: int, collected_at: datetime) -> dict:
+    """Значения колонок новой статьи для многострочного INSERT"""
+    return {
+        'title': article.title,
+        'content': article.content,
+        'link': article.link,
+        'canonical_link': article.canonical_link or canonicalize_link(article.link),
+        'source': article.source,
+        'published_at': article.published_at,
+        'collected_at': collected_at,
+        'content_hash': article.content_hash,
+        'search_history_id': search_history_id,
+        'is_duplicate': False,
+        'is_relevant': False
+    }
+
+
+def save_articles(articles: list, search_history_id: int = None) -> list:
+    """Массовое сохранение статей с пропуском конфликтов по (link, search_history_id)
+    
+    Для SQLite и PostgreSQL используется многострочный INSERT ... ON CONFLICT DO NOTHING,
+    для остальных СУБД - построчное добавление с предварительной проверкой ссылок.
+    Возвращает ID сохраненных статей (уже существовавшие в запросе статьи не сохраняются).
+    """
+    session = get_db_session()
+    try:
+        dialect = session.get_bind().dialect
+        collected_at = datetime.utcnow()
+        
+        # NULL в search_history_id не участвует в уникальном ограничении, поэтому
+        # без истории запроса проверяем ссылки заранее
+        existing_links = find_existing_links(session, [a.link for a in articles]) if search_history_id is None else set()
+        rows = []
+        for article in articles:
+            if article.link in existing_links:
+                continue
+            existing_links.add(article.link)
+            rows.append(_article_to_row(article, search_history_id, collected_at))
+        
+        if dialect.name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        elif dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            insert = None
+        
+        new_ids = []
+        if insert is None:
+            existing_links = find_existing_links(session, [row['link'] for row in rows], search_history_id)
+            new_articles = [NewsArticle(**row) for row in rows if row['link'] not in existing_links]
+            session.add_all(new_articles)
+            session.flush()
+            new_ids = [article.id for article in new_articles]
+        else:
+            # Каждая колонка строки - отдельный параметр запроса
+            chunk_size = rows_per_statement(len(rows[0])) if rows else 1
+            for chunk in iter_chunks(rows, chunk_size):
+                stmt = insert(NewsArticle).values(chunk).on_conflict_do_nothing(
+                    index_elements=['link', 'search_history_id']
+                )
+                if dialect.insert_returning:
+                    new_ids.extend(session.execute(stmt.returning(NewsArticle.id)).scalars())
+                else:
+                    # Старые версии SQLite без RETURNING: ID ищем по вставленным ссылкам
+                    session.execute(stmt)
+                    query = session.query(NewsArticle.id).filter(
+                        NewsArticle.link.in_([row['link'] for row in chunk]),
+                        NewsArticle.collected_at == collected_at
+                    )
+                    if search_history_id is not None:
+                        query = query.filter(NewsArticle.search_history_id == search_history_id)
+                    new_ids.extend(article_id for (article_id,) in query)
+        
+        session.commit()
+        return sorted(new_ids)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def _get_feed_host(feed_url: str) -> str:
+    """Хост RSS канала (для ограничения параллельных запросов к одному серверу)"""
+    return urlparse(feed_url).netloc.lower()
+
+
+def _interleave_by_host(feed_urls: list) -> list:
+    """Чередование каналов разных хостов, чтобы каналы одного сайта не занимали все потоки"""
+    by_host = {}
+    for feed_url in feed_urls:
+        by_host.setdefault(_get_feed_host(feed_url), []).append(feed_url)
+    
+    queues = list(by_host.values())
+    interleaved = []
+    while queues:
+        for queue in queues:
+            interleaved.append(queue.pop(0))
+        queues = [queue for queue in queues if queue]
+    return interleaved
+
+
+def _feed_report_entry(fetch_result: dict, new_articles: int, skipped_by_watermark: int = 0) -> dict:
+    """Запись об итоге загрузки канала для results_data (без распарсенного канала)"""
+    entry = {
+        key: value for key, value in fetch_result.items()
+        if key not in ('feed', 'etag', 'last_modified', 'body_hash')
+    }
+    entry['new_articles'] = new_articles
+    entry['skipped_by_watermark'] = skipped_by_watermark
+    return entry
+
+
+def summarize_feed_report(feed_report: list) -> dict:
+    """Количество каналов по статусам загрузки"""
+    statuses = {}
+    for entry in feed_report:
+        statuses[entry['status']] = statuses.get(entry['status'], 0) + 1
+    return statuses
+
+
+def _load_feed_records(session, feed_urls: list) -> dict:
+    """Загрузка (и создание недостающих) записей RSSFeed для каналов запуска"""
+    records = {
+        record.url: record
+        for record in session.query(RSSFeed).filter(RSSFeed.url.in_(feed_urls)).all()
+    } if feed_urls else {}
+    for feed_url in dict.fromkeys(feed_urls):
+        if feed_url not in records:
+            records[feed_url] = RSSFeed(url=feed_url)
+            session.add(records[feed_url])
+    return records
+
+
+def _get_feed_state(feed_url: str, fetch_result: dict, feed=None,
+                    last_published_at: datetime = None, seen_guids: list = None) -> dict:
+    """Кеш условных запросов и водяной знак канала после успешного опроса (сохраняются save_feed_states)"""
+    return {
+        'url': feed_url,
+        'status': fetch_result['status'],
+        'fetched_at': datetime.utcnow(),
+        'etag': fetch_result.get('etag'),
+        'last_modified': fetch_result.get('last_modified'),
+        'body_hash': fetch_result.get('body_hash'),
+        'name': feed.feed.get('title') if feed is not None else None,
+        'last_published_at': last_published_at,
+        'seen_guids': seen_guids
+    }
+
+
+def _apply_feed_state(record: RSSFeed, state: dict):
+    """Перенос кеша условных запросов и водяного знака в запись канала"""
+    record.last_fetched_at = state['fetched_at']
+    if state['status'] != FETCH_OK:
+        return
+    record.etag = state['etag']
+    record.last_modified = state['last_modified']
+    record.body_hash = state['body_hash']
+    if state['name'] and not record.name:
+        record.name = state['name']
+    last_published_at = state['last_published_at']
+    if last_published_at and (not record.last_published_at or last_published_at > record.last_published_at):
+        record.last_published_at = last_published_at
+    if state['seen_guids'] is not None:
+        record.seen_guids = state['seen_guids']
+
+
+def save_feed_states(feed_states: list):
+    """Сохранение кеша условных запросов и водяных знаков каналов
+    
+    Вызывается после сохранения собранных статей: если статьи не сохранены,
+    следующий запуск не получит 304 / unchanged, не отсечет их водяным знаком
+    и соберет их заново.
+    """
+    if not feed_states:
+        return
+    session = get_db_session()
+    try:
+        records = _load_feed_records(session, [state['url'] for state in feed_states])
+        for state in feed_states:
+            _apply_feed_state(records[state['url']], state)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"Ошибка при сохранении кеша RSS каналов: {e}")
+    finally:
+        session.close()
+
+
+def _get_entry_guid(entry) -> str:
+    """Идентификатор записи канала (guid/id, при отсутствии - ссылка)"""
+    return entry.get('id') or entry.get('link', '')
+
+
+def _get_watermark(record: RSSFeed, safety_hours: float):
+    """Граница дат публикации, до которой записи канала считаются уже обработанными"""
+    if not record.last_published_at:
+        return None
+    return record.last_published_at - timedelta(hours=safety_hours)
+
+
+def fetch_feeds(feed_urls: list, max_workers: int = None, per_host_limit: int = None,
+                validators: dict = None) -> dict:
+    """Загрузка RSS каналов (параллельно, с ограничением на хост)
+    
+    validators - {feed_url: {'etag', 'last_modified', 'body_hash'}} для условных запросов.
+    Возвращает словарь {feed_url: результат fetch_feed}.
+    """
+    validators = validators or {}
+    if max_workers is None:
+        max_workers = Config.RSS_FETCH_MAX_WORKERS
+    if per_host_limit is None:
+        per_host_limit = Config.RSS_FETCH_PER_HOST_LIMIT
+    
+    # Каждый канал загружаем один раз, даже если он указан несколько раз
+    unique_urls = list(dict.fromkeys(feed_urls))
+    host_semaphores = {
+        host: threading.Semaphore(max(1, per_host_limit))
+        for host in {_get_feed_host(feed_url) for feed_url in unique_urls}
+    }
+    
+    def fetch_one(feed_url):
+        with host_semaphores[_get_feed_host(feed_url)]:
+            return feed_url, fetch_feed(feed_url, **validators.get(feed_url, {}))
+    
+    if max_workers <= 1 or len(unique_urls) <= 1:
+        return dict(fetch_one(feed_url) for feed_url in unique_urls)
+    
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_urls))) as executor:
+        return dict(executor.map(fetch_one, _interleave_by_host(unique_urls)))
+
+
+def collect_rss_news(feed_urls: list, max_workers: int = None, per_host_limit: int = None,
+                     feed_report: list = None, watermark_safety_hours: float = None,
+                     feed_states: list = None) -> list:
+    """Сбор новостей из RSS каналов
+    
+    Каналы загружаются параллельно, а статьи обрабатываются в исходном порядке каналов,
+    поэтому результат совпадает с последовательным сбором.
+    Записи не новее водяного знака канала (с запасом watermark_safety_hours) пропускаются
+    без обращения к БД.
+    Если передан список feed_report, в него добавляется итог загрузки каждого канала.
+    Если передан список feed_states, кеш условных запросов (ETag, Last-Modified, хеш тела)
+    и водяные знаки каналов не сохраняются, а добавляются в него: вызывающий сохраняет
+    их через save_feed_states() после сохранения статей. Иначе они сохраняются сразу.
+    """
+    if watermark_safety_hours is None:
+        watermark_safety_hours = Config.RSS_WATERMARK_SAFETY_HOURS
+    
     all_articles = []
+    pending_states = []
+    # Канонические ссылки, уже попавшие в результат (одна статья может быть в нескольких каналах)
+    seen_links = set()
+    feed_urls = [feed_url.strip() for feed_url in feed_urls if feed_url.strip()]
     session = get_db_session()
     
     try:
+        feed_records = _load_feed_records(session, feed_urls)
+        validators = {
+            feed_url: {
+                'etag': record.etag,
+                'last_modified': record.last_modified,
+                'body_hash': record.body_hash
+            }
+            for feed_url, record in feed_records.items()
+        }
+        fetched = fetch_feeds(feed_urls, max_workers, per_host_limit, validators)
+        
         for feed_url in feed_urls:
-            if not feed_url.strip():
-                continue
-                
+            fetch_result = fetched[feed_url]
+            new_articles = 0
+            skipped_by_watermark = 0
             try:
-                feed = feedparser.parse(feed_url.strip())
+                if fetch_result['status'] not in FETCH_SUCCESS_STATUSES:
+                    print(f"RSS канал {feed_url} пропущен ({fetch_result['status']}): {fetch_result['error']}")
+                    continue
+                if fetch_result['status'] != FETCH_OK:
+                    # Канал не изменился с прошлой загрузки - новых статей в нем нет
+                    pending_states.append(_get_feed_state(feed_url, fetch_result))
+                    continue
+                
+                feed = fetch_result['feed']
+                record = feed_records[feed_url]
+                watermark = _get_watermark(record, watermark_safety_hours)
+                newest_published_at = None
+                seen_guids = set(record.seen_guids or [])
+                undated_guids = []
+                candidates = []
                 
                 for entry in feed.entries:
-                    title = entry.get('title', '')
-                    link = entry.get('link', '')
-                    content = entry.get('summary', '') or entry.get('description', '')
-                    
                     # Парсинг даты публикации
                     published_at = None
                     if hasattr(entry, 'published_parsed') and entry.published_parsed:
                         published_at = datetime(*entry.published_parsed[:6])
                     
-                    # Проверка на существование статьи (по link, без учета search_history_id)
-                    # Одна и та же статья может быть в разных запросах
-                    existing = session.query(NewsArticle).filter_by(link=link).first()
-                    if existing:
+                    # Водяной знак: уже обработанные записи отсекаем до хеширования и запросов к БД
+                    if published_at is not None:
+                        if not newest_published_at or published_at > newest_published_at:
+                            newest_published_at = published_at
+                        if watermark and published_at <= watermark:
+                            skipped_by_watermark += 1
+                            continue
+                    else:
+                        # Записи без даты: пропускаем только GUID, увиденные при прошлом опросе
+                        # (порядок записей в канале может быть любым)
+                        guid = _get_entry_guid(entry)
+                        undated_guids.append(guid)
+                        if guid in seen_guids:
+                            skipped_by_watermark += 1
+                            continue
+                    
+                    candidates.append((entry, published_at))
+                
+                # Проверка на существование статей (по link, без учета search_history_id) -
+                # один запрос на канал. Одна и та же статья может быть в разных запросах
+                existing_links = find_existing_links(session, [entry.get('link', '') for entry, _ in candidates])
+                
+                for entry, published_at in candidates:
+                    title = entry.get('title', '')
+                    link = entry.get('link', '')
+                    content = entry.get('summary', '') or entry.get('description', '')
+                    
+                    canonical_link = canonicalize_link(link)
+                    if link in existing_links or canonical_link in seen_links:
                         continue
+                    seen_links.add(canonical_link)
                     
                     content_hash = get_content_hash(title, content)
                     
@@ -47,18 +380,33 @@ def collect_rss_news(feed_urls: list) -> list:
                         title=title,
                         content=content,
                         link=link,
+                        canonical_link=canonical_link,
                         source=feed.feed.get('title', feed_url),
                         published_at=published_at,
                         content_hash=content_hash
                     )
                     all_articles.append(article)
+                    new_articles += 1
                     
+                # Даты из будущего (ошибки часовых поясов) не должны сдвигать водяной знак вперед
+                if newest_published_at:
+                    newest_published_at = min(newest_published_at, datetime.utcnow())
+                pending_states.append(_get_feed_state(
+                    feed_url, fetch_result, feed, newest_published_at, undated_guids[:SEEN_GUIDS_LIMIT]
+                ))
+                
             except Exception as e:
                 print(f"Ошибка при парсинге RSS канала {feed_url}: {e}")
+                fetch_result = dict(fetch_result, status=FETCH_PARSE_ERROR, error=str(e))
                 continue
-                
+            finally:
+                if feed_report is not None:
+                    feed_report.append(_feed_report_entry(fetch_result, new_articles, skipped_by_watermark))
     finally:
         session.close()
     
+    if feed_states is None:
+        save_feed_states(pending_states)
+    else:
+        feed_states.extend(pending_states)
     return all_articles
-
@@ -0,0 +1,261 @@
+"""Структурированный JSON ответ LLM
+
+Запросы классификации отправляются в режиме JSON ответа сервера
+(`response_format: json_object`) с ограничением max_tokens и потоковой
+передачей: ответом считается первый закрытый JSON объект, текст после него
+отбрасывается. Поток дочитывается до конца, включая данные после [DONE]
+(его длину ограничивает max_tokens), чтобы соединение вернулось в пул
+keep-alive; при LLM_STREAM_EARLY_STOP чтение прекращается сразу после
+закрытия объекта ценой закрытия соединения. Поддержка режима
+определяется автоматически для каждой пары (endpoint, модель): если сервер
+отклоняет запрос с response_format, запрос повторяется в обычном режиме, и
+только при успехе повтора пара запоминается как неподдерживающая (ошибки,
+не связанные с response_format, - длина контекста, неизвестная модель -
+не меняют решение).
+"""
+import json
+
+import requests
+
+from config import Config
+from agents.rate_limiter import post_with_rate_limit, acquire_chat_slot, chat_completions_url, estimate_tokens
+
+# HTTP статусы, которыми серверы отклоняют неизвестные параметры запроса
+UNSUPPORTED_STATUSES = (400, 404, 415, 422)
+# Сколько открывающих скобок проверяется при поиске JSON в свободном тексте
+MAX_JSON_CANDIDATES = 20
+
+# (endpoint, модель) -> поддерживается ли структурированный режим
+_support = {}
+
+
+class JsonStreamScanner:
+    """Поиск конца первого JSON объекта или массива в тексте, поступающем частями"""
+    
+    def __init__(self, openers: str = '{['):
+        self.openers = openers
+        self.parts = []
+        self.length = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.start = None
+        self.end = None
+    
+    @property
+    def closed(self) -> bool:
+        return self.end is not None
+    
+    def feed(self, chunk: str) -> bool:
+        """Добавление части текста; True, если первый JSON объект закрыт"""
+        if self.closed:
+            return True
+        offset = self.length
+        self.parts.append(chunk)
+        self.length += len(chunk)
+        for position, char in enumerate(chunk):
+            if self.start is None:
+                if char in self.openers:
+                    self.start = offset + position
+                    self.depth = 1
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in '{[':
+                self.depth += 1
+            elif char in '}]':
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = offset + position + 1
+                    return True
+        return False
+    
+    @property
+    def text(self) -> str:
+        """Весь полученный текст"""
+        return ''.join(self.parts)
+    
+    def value_text(self) -> str:
+        """Текст первого закрытого JSON значения (весь текст, если значение не закрыто)"""
+        text = self.text
+        if self.closed:
+            return text[self.start:self.end]
+        return text
+
+
+def parse_json_value(content: str, openers: str = '{['):
+    """Первое JSON значение (объект или массив) в ответе LLM; None, если не найдено
+    
+    Ответ в структурированном режиме разбирается целиком, в свободном тексте
+    (в т.ч. в блоке ```json) ищется первый сбалансированный объект, который
+    удается разобрать.
+    """
+    if not content:
+        return None
+    stripped = content.strip()
+    if stripped[:1] in openers:
+        try:
+            return json.loads(stripped)
+        except json.JSONDecodeError:
+            pass
+    
+    position = 0
+    for _ in range(MAX_JSON_CANDIDATES):
+        starts = [index for index in (content.find(opener, position) for opener in openers) if index != -1]
+        if not starts:
+            return None
+        position = min(starts)
+        scanner = JsonStreamScanner(openers)
+        if scanner.feed(content[position:]):
+            try:
+                return json.loads(scanner.value_text())
+            except json.JSONDecodeError:
+                pass
+        position += 1
+    return None
+
+
+def _structured_mode_enabled(key: tuple) -> bool:
+    """Использовать ли структурированный режим для (endpoint, модель)"""
+    mode = Config.LLM_STRUCTURED_OUTPUT
+    if mode == 'off':
+        return False
+    if mode == 'on':
+        return True
+    return _support.get(key, True)
+
+
+def _mark_support(key: tuple, supported: bool):
+    if Config.LLM_STRUCTURED_OUTPUT == 'auto' and _support.get(key) != supported:
+        _support[key] = supported
+        if not supported:
+            print(f"Endpoint {key[0]} (модель {key[1]}) не поддерживает JSON режим ответа, используется обычный режим")
+
+
+def _read_event_stream(response) -> str:
+    """Первый JSON объект из потока server-sent events
+    
+    Тело читается до конца: close() недочитанного ответа закрывает соединение
+    вместо возврата в пул. Исключение - LLM_STREAM_EARLY_STOP.
+    """
+    scanner = JsonStreamScanner()
+    response.encoding = 'utf-8'
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            data = line[5:].strip()
+            if data == '[DONE]' or scanner.closed:
+                continue
+            try:
+                event = json.loads(data)
+            except json.JSONDecodeError:
+                continue
+            choices = event.get('choices') or []
+            if not choices:
+                continue
+            delta = (choices[0].get('delta') or {}).get('content')
+            # После закрытия объекта остаток потока только дочитывается
+            if delta and scanner.feed(delta) and Config.LLM_STREAM_EARLY_STOP:
+                break
+    finally:
+        response.close()
+    return scanner.value_text()
+
+
+def _post_chat_completion(prompt: str, llm_model: str, llm_temperature: float, max_tokens: int,
+                          timeout: float, structured: bool) -> str:
+    """Текст ответа chat completions; при structured - с response_format и stream"""
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {Config.OPENAI_API_KEY}'
+    }
+    
+    payload = {
+        'model': llm_model,
+        'messages': [
+            {'role': 'user', 'content': prompt}
+        ],
+        'temperature': llm_temperature,
+        'max_tokens': max_tokens
+    }
+    if structured:
+        payload['response_format'] = {'type': 'json_object'}
+        payload['stream'] = True
+    
+    response = post_with_rate_limit(chat_completions_url(), llm_model, estimate_tokens(prompt, max_tokens),
+                                    headers=headers, json=payload, timeout=timeout, stream=structured)
+    if not response.ok:
+        # Тело ошибки небольшое: читаем его, чтобы соединение вернулось в пул
+        _ = response.content
+        response.raise_for_status()
+    
+    # Сервер может проигнорировать stream и вернуть обычный ответ
+    if structured and 'text/event-stream' in response.headers.get('Content-Type', ''):
+        return _read_event_stream(response)
+    result = response.json()
+    return result['choices'][0]['message']['content']
+
+
+def json_chat_completion(prompt: str, llm_model: str, llm_temperature: float, max_tokens: int,
+                         timeout: float = 30) -> str:
+    """Текст JSON ответа chat completions через прямой HTTP запрос к OPENAI_API_BASE
+    
+    В структурированном режиме запрос отправляется с response_format и stream,
+    иначе - обычным запросом; max_tokens ограничивает ответ в обоих случаях.
+    """
+    key = (chat_completions_url(), llm_model)
+    if not _structured_mode_enabled(key):
+        return _post_chat_completion(prompt, llm_model, llm_temperature, max_tokens, timeout, False)
+    
+    try:
+        content = _post_chat_completion(prompt, llm_model, llm_temperature, max_tokens, timeout, True)
+    except requests.HTTPError as e:
+        status_code = e.response.status_code if e.response is not None else None
+        if Config.LLM_STRUCTURED_OUTPUT != 'auto' or status_code not in UNSUPPORTED_STATUSES:
+            raise
+        # Ошибка повторится и без response_format, если причина в другом - тогда решение не меняем
+        content = _post_chat_completion(prompt, llm_model, llm_temperature, max_tokens, timeout, False)
+        _mark_support(key, False)
+        return content
+    _mark_support(key, True)
+    return content
+
+
+def langchain_json_completion(llm, prompt: str, llm_model: str, max_tokens: int) -> str:
+    """Текст JSON ответа через клиент LangChain (тот же режим и автоопределение, что и для HTTP)"""
+    key = (chat_completions_url(), llm_model)
+    acquire_chat_slot(llm_model, prompt, max_tokens)
+    
+    if Config.LLM_STRUCTURED_OUTPUT == 'off':
+        response = llm.invoke(prompt)
+        return response.content if hasattr(response, 'content') else str(response)
+    
+    if _structured_mode_enabled(key):
+        try:
+            scanner = JsonStreamScanner()
+            # Поток дочитывается до конца, чтобы соединение вернулось в пул (кроме LLM_STREAM_EARLY_STOP)
+            for chunk in llm.bind(response_format={'type': 'json_object'}, max_tokens=max_tokens).stream(prompt):
+                content = chunk.content if hasattr(chunk, 'content') else str(chunk)
+                if isinstance(content, str) and content and not scanner.closed:
+                    if scanner.feed(content) and Config.LLM_STREAM_EARLY_STOP:
+                        break
+            _mark_support(key, True)
+            return scanner.value_text()
+        except Exception as e:
+            if Config.LLM_STRUCTURED_OUTPUT != 'auto' or getattr(e, 'status_code', None) not in UNSUPPORTED_STATUSES:
+                raise
+            # Неподдерживающей пара считается, только если запрос без response_format проходит
+            response = llm.bind(max_tokens=max_tokens).invoke(prompt)
+            _mark_support(key, False)
+            return response.content if hasattr(response, 'content') else str(response)
+    
+    response = llm.bind(max_tokens=max_tokens).invoke(prompt)
+    return response.content if hasattr(response, 'content') else str(response)
@@ -2,10 +2,24 @@
 from config import Config
 from models import NewsArticle
 from agents.llm_utils import create_llm_with_settings
+from agents.rate_limiter import post_with_rate_limit, acquire_chat_slot, chat_completions_url, estimate_tokens
+from agents.summary_cache import load_cached_summaries, store_summaries
+from agents.db_utils import update_by_id
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 import json
 import re
 
+# Режимы генерации саммари
+SUMMARY_MODES = ('llm', 'extractive', 'combined')
+# Максимальная длина ответа LLM с саммари (токенов) и длина текста статьи в промпте (символов)
+SUMMARY_MAX_TOKENS = 200
+SUMMARY_MAX_CONTENT_LENGTH = 2000
+# Количество саммари, после которого они сохраняются в БД
+SUMMARY_SAVE_EVERY = 10
+# Версия промпта саммари (часть ключа кэша; увеличивать при изменении промпта)
+SUMMARY_PROMPT_VERSION = '1'
+
 
 def generate_summary_with_direct_api(article: NewsArticle, llm_model: str = None, llm_temperature: float = None) -> str:
     """Генерация саммари через прямой HTTP запрос к API"""
@@ -17,25 +31,8 @@ def generate_summary_with_direct_api(article: NewsArticle, llm_model: str = None
     if llm_temperature is None:
         llm_temperature = Config.LLM_TEMPERATURE
     
-    # Формируем URL для запроса
-    if Config.OPENAI_API_BASE and Config.OPENAI_API_BASE.strip():
-        api_url = Config.OPENAI_API_BASE.rstrip('/')
-        if not api_url.endswith('/chat/completions'):
-            if api_url.endswith('/v1'):
-                api_url = f"{api_url}/chat/completions"
-            else:
-                api_url = f"{api_url}/v1/chat/completions"
-    else:
-        # Используем стандартный OpenAI endpoint
-        api_url = "https://api.openai.com/v1/chat/completions"
-    
-    # Очищаем HTML из контента для саммари
-    content_clean = clean_html(article.content or '')
-    
-    # Ограничиваем длину контента для экономии токенов
-    max_content_length = 2000
-    if len(content_clean) > max_content_length:
-        content_clean = content_clean[:max_content_length] + "..."
+    api_url = chat_completions_url()
+    content_clean = prepare_summary_content(article)
     
     prompt = f"""Создай краткое саммари следующей новости на русском языке (2-3 предложения, максимум 150 слов).
 
@@ -61,11 +58,12 @@ def generate_summary_with_direct_api(article: NewsArticle, llm_model: str = None
             {'role': 'user', 'content': prompt}
         ],
         'temperature': llm_temperature,
-        'max_tokens': 200
+        'max_tokens': SUMMARY_MAX_TOKENS
     }
     
     try:
-        response = requests.post(api_url, headers=headers, json=payload, timeout=30)
+        response = post_with_rate_limit(api_url, llm_model, estimate_tokens(prompt, payload['max_tokens']),
+                                        headers=headers, json=payload, timeout=30)
         response.raise_for_status()
         data = response.json()
         
@@ -90,14 +88,7 @@ def generate_summary_with_langchain(article: NewsArticle, llm_model: str = None,
         from langchain.schema import HumanMessage
         
         llm = create_llm_with_settings(llm_model, llm_temperature)
-        
-        # Очищаем HTML из контента
-        content_clean = clean_html(article.content or '')
-        
-        # Ограничиваем длину контента
-        max_content_length = 2000
-        if len(content_clean) > max_content_length:
-            content_clean = content_clean[:max_content_length] + "..."
+        content_clean = prepare_summary_content(article)
         
         prompt = ChatPromptTemplate.from_messages([
             ("system", "Ты эксперт по созданию кратких саммари новостей. Создавай информативные и лаконичные саммари на русском языке (2-3 предложения, максимум 150 слов)."),
@@ -109,6 +100,7 @@ def generate_summary_with_langchain(article: NewsArticle, llm_model: str = None,
             content=content_clean
         )
         
+        acquire_chat_slot(llm_model or Config.LLM_MODEL, ''.join(message.content for message in messages), SUMMARY_MAX_TOKENS)
         response = llm.invoke(messages)
         summary = response.content.strip()
         return summary
@@ -118,11 +110,11 @@ def generate_summary_with_langchain(article: NewsArticle, llm_model: str = None,
         return None
 
 
-def generate_summary(article: NewsArticle, llm_model: str = None, llm_temperature: float = None) -> str:
-    """Генерация саммари статьи (автоматический выбор метода)"""
+def generate_llm_summary(article: NewsArticle, llm_model: str = None, llm_temperature: float = None) -> str:
+    """Генерация саммари через LLM (прямой API, затем LangChain); None, если LLM недоступна"""
     if not Config.OPENAI_API_KEY:
         print("OPENAI_API_KEY не установлен, используем простое саммари")
-        return generate_simple_summary(article)
+        return None
     
     # Пробуем прямой API запрос
     try:
@@ -140,6 +132,15 @@ def generate_summary(article: NewsArticle, llm_model: str = None, llm_temperatur
     except Exception as e:
         print(f"Ошибка при использовании LangChain для саммари: {e}")
     
+    return None
+
+
+def generate_summary(article: NewsArticle, llm_model: str = None, llm_temperature: float = None) -> str:
+    """Генерация саммари статьи (автоматический выбор метода)"""
+    summary = generate_llm_summary(article, llm_model, llm_temperature)
+    if summary:
+        return summary
+    
     # Если все методы не сработали, создаем простое саммари из первых предложений
     return generate_simple_summary(article)
 
@@ -190,20 +191,119 @@ def clean_html(text: str) -> str:
     return text
 
 
-def generate_summaries_for_articles(articles: list, llm_model: str = None, llm_temperature: float = None):
-    """Генерация саммари для списка статей"""
+def prepare_summary_content(article: NewsArticle, max_length: int = None) -> str:
+    """Текст статьи для промпта саммари: без HTML, не длиннее max_length (`SUMMARY_MAX_CONTENT_LENGTH`)"""
+    if max_length is None:
+        max_length = SUMMARY_MAX_CONTENT_LENGTH
+    content_clean = clean_html(article.content or '')
+    # Ограничиваем длину контента для экономии токенов
+    if len(content_clean) > max_length:
+        content_clean = content_clean[:max_length] + "..."
+    return content_clean
+
+
+def _save_summaries(session, articles: list):
+    """Сохранение саммари пакетным UPDATE по ID статей"""
+    if not articles:
+        return
+    update_by_id(session, NewsArticle, [{'id': article.id, 'summary': article.summary} for article in articles])
+    session.commit()
+
+
+def generate_summaries_for_articles(articles: list, llm_model: str = None, llm_temperature: float = None,
+                                    concurrency: int = None, progress_callback=None, summary_mode: str = None):
+    """Генерация саммари для списка статей
+    
+    Одновременно выполняется не более concurrency запросов (`SUMMARY_CONCURRENCY`).
+    Саммари сохраняются в БД порциями по SUMMARY_SAVE_EVERY по мере готовности,
+    поэтому ошибка в конце не теряет уже полученные саммари. После каждой
+    статьи вызывается progress_callback(обработано, всего).
+    
+    Перед обращением к LLM саммари ищутся в кэше (`SUMMARY_CACHE_ENABLED`)
+    по content_hash статьи, модели и версии промпта; новые саммари LLM
+    добавляются в кэш.
+    
+    summary_mode (`SUMMARY_MODE`): llm - саммари через LLM, extractive -
+    локальное экстрактивное саммари (TextRank) без обращений к LLM и кэшу,
+    combined - саммари уже получены вместе с классификацией, через LLM
+    генерируются только недостающие (статьи из кэша классификации и т.п.).
+    """
     from models import get_db_session
+    from agents.extractive_summarizer import generate_extractive_summary
+    
+    if concurrency is None:
+        concurrency = Config.SUMMARY_CONCURRENCY
+    concurrency = max(1, concurrency)
     
+    if llm_model is None:
+        llm_model = Config.LLM_MODEL
+    if summary_mode is None:
+        summary_mode = Config.SUMMARY_MODE
+    use_cache = Config.SUMMARY_CACHE_ENABLED and summary_mode != 'extractive'
+    
+    def summarize(article):
+        # Возвращает саммари и признак того, что оно получено от LLM (только такие кэшируются)
+        if summary_mode == 'extractive':
+            return generate_extractive_summary(article), False
+        summary = generate_llm_summary(article, llm_model, llm_temperature)
+        if summary:
+            return summary, True
+        return generate_simple_summary(article), False
+    
+    # Генерируем только если еще нет саммари
+    pending = [article for article in articles if not article.summary]
+    total = len(pending)
     session = get_db_session()
     try:
-        for article in articles:
-            if not article.summary:  # Генерируем только если еще нет саммари
-                summary = generate_summary(article, llm_model, llm_temperature)
+        done = 0
+        unsaved = []
+        to_cache = {}
+        
+        if use_cache and pending:
+            cached = load_cached_summaries(session, [article.content_hash for article in pending], llm_model, SUMMARY_PROMPT_VERSION)
+            if cached:
+                remaining = []
+                for article in pending:
+                    if article.content_hash in cached:
+                        article.summary = cached[article.content_hash]
+                        unsaved.append(article)
+                    else:
+                        remaining.append(article)
+                pending = remaining
+                done = len(unsaved)
+                print(f"Из кэша саммари получено {done} из {total} статей")
+                _save_summaries(session, unsaved)
+                unsaved = []
+                if progress_callback:
+                    progress_callback(done, total)
+        
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {executor.submit(summarize, article): article for article in pending}
+            for future in as_completed(futures):
+                article = futures[future]
+                try:
+                    summary, from_llm = future.result()
+                except Exception as e:
+                    print(f"Ошибка при генерации саммари для статьи {article.id}: {e}")
+                    summary, from_llm = None, False
                 if summary:
                     article.summary = summary
-                    session.add(article)
+                    unsaved.append(article)
+                    if use_cache and from_llm and article.content_hash:
+                        to_cache[article.content_hash] = summary
+        
+                if len(unsaved) >= SUMMARY_SAVE_EVERY:
+                    _save_summaries(session, unsaved)
+                    store_summaries(session, to_cache, llm_model, SUMMARY_PROMPT_VERSION)
+                    unsaved = []
+                    to_cache = {}
+                
+                done += 1
+                if progress_callback:
+                    progress_callback(done, total)
         
-        session.commit()
+        _save_summaries(session, unsaved)
+        store_summaries(session, to_cache, llm_model, SUMMARY_PROMPT_VERSION)
     except Exception as e:
         session.rollback()
         print(f"Ошибка при сохранении саммари: {e}")
@@ -0,0 +1,41 @@
+"""Кэш саммари статей по содержимому
+
+Ключ кэша - (content_hash статьи, модель, версия промпта саммари). Саммари
+не зависит от критерия отбора, поэтому статья с тем же текстом, признанная
+релевантной в другом запросе, получает саммари без обращения к LLM.
+Простые саммари (первые предложения текста при недоступности LLM) в кэш
+не попадают.
+"""
+from models import SummaryCache
+from agents.db_utils import iter_chunks, insert_missing
+
+
+def load_cached_summaries(session, content_hashes: list, llm_model: str, prompt_version: str) -> dict:
+    """Закэшированные саммари: {content_hash: summary}"""
+    content_hashes = list({content_hash for content_hash in content_hashes if content_hash})
+    cached = {}
+    for chunk in iter_chunks(content_hashes):
+        query = session.query(SummaryCache.content_hash, SummaryCache.summary).filter(
+            SummaryCache.content_hash.in_(chunk),
+            SummaryCache.llm_model == llm_model,
+            SummaryCache.prompt_version == prompt_version
+        )
+        cached.update(query.all())
+    return cached
+
+
+def store_summaries(session, summaries: dict, llm_model: str, prompt_version: str):
+    """Сохранение саммари {content_hash: summary} в кэш (без перезаписи существующих)"""
+    rows = [
+        {
+            'content_hash': content_hash,
+            'llm_model': llm_model,
+            'prompt_version': prompt_version,
+            'summary': summary
+        }
+        for content_hash, summary in summaries.items()
+    ]
+    insert_missing(
+        session, SummaryCache, rows, 'content_hash',
+        lambda content_hashes: load_cached_summaries(session, content_hashes, llm_model, prompt_version)
+    )
@@ -6,7 +6,7 @@ import time
 from datetime import datetime
 from sqlalchemy import func
 from config import Config
-from models import NewsArticle, SearchHistory, SystemSettings, get_db_session, init_db, engine, get_all_settings, get_setting, update_setting
+from models import NewsArticle, SearchHistory, SystemSettings, DuplicateCluster, ClassificationCache, SummaryCache, get_db_session, init_db, engine, get_all_settings, get_setting, update_setting, update_search_history_results, reset_feed_cache
 
 app = Flask(__name__)
 app.secret_key = Config.FLASK_SECRET_KEY
@@ -77,7 +77,7 @@ class ProgressTracker:
         }
 
 
-def process_news_with_progress(task_id, feed_urls, criteria, llm_model=None, llm_temperature=None, similarity_threshold=None, relevance_threshold=None, openai_api_base=None):
+def process_news_with_progress(task_id, feed_urls, criteria, llm_model=None, llm_temperature=None, similarity_threshold=None, relevance_threshold=None, openai_api_base=None, summary_mode=None):
     """Обработка новостей с отслеживанием прогресса"""
     tracker = tasks_status[task_id]
     
@@ -93,10 +93,14 @@ def process_news_with_progress(task_id, feed_urls, criteria, llm_model=None, llm
         similarity_threshold = Config.SIMILARITY_THRESHOLD
     if openai_api_base is None:
         openai_api_base = Config.OPENAI_API_BASE
+    if summary_mode is None:
+        summary_mode = Config.SUMMARY_MODE
     
     # Импорты в начале функции
-    from agents.rss_collector import collect_rss_news
+    from agents.rss_collector import collect_rss_news, summarize_feed_report, save_articles, save_feed_states
+    from agents.feed_fetcher import FETCH_SUCCESS_STATUSES
     from agents.deduplicator import find_duplicates, mark_duplicates
+    from agents.fingerprint_store import link_previous_articles
     from agents.classifier import classify_articles_with_settings
     from models import get_db_session  # Явный импорт для избежания проблем с областью видимости
     import json
@@ -120,7 +124,8 @@ def process_news_with_progress(task_id, feed_urls, criteria, llm_model=None, llm
                 similarity_threshold=similarity_threshold,
                 openai_api_base=openai_api_base or '',
                 results_data={
-                    'relevance_threshold': relevance_threshold
+                    'relevance_threshold': relevance_threshold,
+                    'summary_mode': summary_mode
                 }
             )
             session.add(search_history)
@@ -139,36 +144,24 @@ def process_news_with_progress(task_id, feed_urls, criteria, llm_model=None, llm
         # Шаг 1: Сбор новостей
         tracker.update_step(0, 'running', 0, 'Начало сбора новостей...')
         
-        articles = collect_rss_news(feed_urls)
-        tracker.update_step(0, 'running', 50, f'Собрано {len(articles)} статей')
+        feed_report = []
+        feed_states = []
+        articles = collect_rss_news(feed_urls, feed_report=feed_report, feed_states=feed_states)
+        feed_statuses = summarize_feed_report(feed_report)
+        update_search_history_results(search_history_id, {'feeds': feed_report, 'feed_statuses': feed_statuses})
+        failed_feeds = sum(1 for entry in feed_report if entry['status'] not in FETCH_SUCCESS_STATUSES)
+        if failed_feeds:
+            tracker.update_step(0, 'running', 50, f'Собрано {len(articles)} статей (каналов с ошибками: {failed_feeds})')
+        else:
+            tracker.update_step(0, 'running', 50, f'Собрано {len(articles)} статей')
         
         if articles:
-            session = get_db_session()
-            try:
-                saved_count = 0
-                for article in articles:
-                    # Проверяем, не существует ли уже эта статья в текущем запросе
-                    existing = session.query(NewsArticle).filter(
-                        NewsArticle.link == article.link,
-                        NewsArticle.search_history_id == search_history_id
-                    ).first()
-                    
-                    if existing:
-                        continue  # Пропускаем, если уже есть в этом запросе
-                    
-                    article.search_history_id = search_history_id
-                    session.add(article)
-                    saved_count += 1
-                
-                session.commit()
-                tracker.update_step(0, 'completed', 100, f'Сохранено {saved_count} новых статей (из {len(articles)} собранных)')
-            except Exception as e:
-                session.rollback()
-                raise e
-            finally:
-                session.close()
+            saved_ids = save_articles(articles, search_history_id)
+            tracker.update_step(0, 'completed', 100, f'Сохранено {len(saved_ids)} новых статей (из {len(articles)} собранных)')
         else:
             tracker.update_step(0, 'completed', 100, 'Новых новостей не найдено')
+        # Кеш каналов сохраняется только после статей: при ошибке сохранения статьи будут собраны повторно
+        save_feed_states(feed_states)
         
         # Получение необработанных статей для текущего запроса
         session = get_db_session()
@@ -194,9 +187,16 @@ def process_news_with_progress(task_id, feed_urls, criteria, llm_model=None, llm
         
         if duplicates:
             mark_duplicates(unprocessed_articles, duplicates)
-            tracker.update_step(1, 'completed', 100, f'Помечено {len(duplicates)} дубликатов')
+        
+        # Связывание с похожими статьями прошлых запросов (их оценки, саммари и embeddings переиспользуются)
+        reuse_stats = link_previous_articles(search_history_id, criteria, relevance_threshold, similarity_threshold)
+        reused_article_ids = reuse_stats.pop('article_ids')
+        update_search_history_results(search_history_id, {'reused': reuse_stats})
+        
+        if duplicates:
+            tracker.update_step(1, 'completed', 100, f'Помечено {len(duplicates)} дубликатов, найдено в прошлых запросах: {reuse_stats["matched"]}')
         else:
-            tracker.update_step(1, 'completed', 100, 'Дубликаты не найдены')
+            tracker.update_step(1, 'completed', 100, f'Дубликаты не найдены, найдено в прошлых запросах: {reuse_stats["matched"]}')
         
         # Получение уникальных статей для текущего запроса
         session = get_db_session()
@@ -223,12 +223,27 @@ def process_news_with_progress(task_id, feed_urls, criteria, llm_model=None, llm
         tracker.update_step(2, 'running', 0, f'Классификация {len(unique_articles)} статей по критерию: {criteria[:50]}...')
         
         total = len(unique_articles)
-        for i, article in enumerate(unique_articles):
-            classify_articles_with_settings([article], criteria, llm_model, llm_temperature, relevance_threshold)
-            progress = int((i + 1) / total * 100)
-            tracker.update_step(2, 'running', progress, f'Обработано {i + 1} из {total} статей')
         
-        tracker.update_step(2, 'completed', 100, f'Классифицировано {total} статей')
+        def on_classified(done, pending_total):
+            progress = int(done / pending_total * 100) if pending_total else 100
+            tracker.update_step(2, 'running', progress, f'Обработано {done} из {pending_total} статей')
+        
+        # Пакеты статей классифицируются параллельно (не более CLASSIFICATION_CONCURRENCY запросов),
+        # прогресс обновляется по завершении каждого запроса; в режиме combined саммари
+        # релевантных статей запрашивается в том же ответе LLM. Статьи не из кэша, далекие
+        # от критерия по embeddings, отсеиваются предварительным фильтром без LLM
+        classification_stats = classify_articles_with_settings(
+            unique_articles, criteria, llm_model, llm_temperature, relevance_threshold,
+            progress_callback=on_classified, with_summary=summary_mode == 'combined',
+            search_history_id=search_history_id
+        )
+        prefilter_skipped = classification_stats['prefilter_skipped']
+        update_search_history_results(search_history_id, {'prefilter_skipped': prefilter_skipped})
+        
+        if prefilter_skipped:
+            tracker.update_step(2, 'completed', 100, f'Классифицировано {total} статей (без LLM по embeddings: {prefilter_skipped})')
+        else:
+            tracker.update_step(2, 'completed', 100, f'Классифицировано {total} статей')
         
         # Шаг 4: Генерация саммари для релевантных статей (опционально)
         # Загружаем релевантные статьи заново из БД
@@ -246,7 +261,14 @@ def process_news_with_progress(task_id, feed_urls, criteria, llm_model=None, llm
             try:
                 from agents.summarizer import generate_summaries_for_articles
                 tracker.update_step(3, 'running', 0, f'Генерация саммари для {len(relevant_articles)} релевантных статей...')
-                generate_summaries_for_articles(relevant_articles, llm_model, llm_temperature)
+                
+                def on_summarized(done, pending_total):
+                    progress = int(done / pending_total * 100) if pending_total else 100
+                    tracker.update_step(3, 'running', progress, f'Саммари: {done} из {pending_total} статей')
+                
+                # Саммари генерируются параллельно (не более SUMMARY_CONCURRENCY запросов) и сохраняются порциями
+                generate_summaries_for_articles(relevant_articles, llm_model, llm_temperature,
+                                                progress_callback=on_summarized, summary_mode=summary_mode)
                 tracker.update_step(3, 'completed', 100, f'Саммари сгенерировано для {len(relevant_articles)} статей')
             except Exception as e:
                 print(f"Ошибка при генерации саммари: {e}")
@@ -261,7 +283,7 @@ def process_news_with_progress(task_id, feed_urls, criteria, llm_model=None, llm
         try:
             from agents.embeddings import generate_embeddings_for_articles_by_ids
             tracker.update_step(4, 'running', 0, f'Генерация векторных представлений для {len(unique_article_ids)} статей...')
-            generate_embeddings_for_articles_by_ids(unique_article_ids, search_history_id)
+            generate_embeddings_for_articles_by_ids(unique_article_ids + reused_article_ids, search_history_id)
             tracker.update_step(4, 'completed', 100, f'Векторные представления сгенерированы для {len(unique_articles)} статей')
         except Exception as e:
             print(f"Ошибка при генерации embeddings: {e}")
@@ -299,6 +321,7 @@ def process_news_with_progress(task_id, feed_urls, criteria, llm_model=None, llm
                 search_history = session.query(SearchHistory).filter_by(id=search_history_id).first()
                 if search_history:
                     search_history.results_data = {
+                        **(search_history.results_data or {}),
                         'total': total_count,
                         'relevant': relevant,
                         'duplicates': duplicates_count,
@@ -329,6 +352,7 @@ def index():
         'llm_temperature': Config.LLM_TEMPERATURE,
         'similarity_threshold': Config.SIMILARITY_THRESHOLD,
         'relevance_threshold': Config.RELEVANCE_THRESHOLD,
+        'summary_mode': Config.SUMMARY_MODE,
         'openai_api_base': Config.OPENAI_API_BASE if Config.OPENAI_API_BASE else 'По умолчанию (OpenAI)',
         'rss_feeds': '\n'.join(Config.RSS_FEEDS) if Config.RSS_FEEDS else '',
         'selection_criteria': Config.SELECTION_CRITERIA if Config.SELECTION_CRITERIA else ''
@@ -349,6 +373,7 @@ def start_processing():
     llm_temperature = float(data.get('llm_temperature', Config.LLM_TEMPERATURE))
     similarity_threshold = float(data.get('similarity_threshold', Config.SIMILARITY_THRESHOLD))
     relevance_threshold = float(data.get('relevance_threshold', Config.RELEVANCE_THRESHOLD))
+    summary_mode = (data.get('summary_mode') or Config.SUMMARY_MODE).strip().lower()
     # API Endpoint берется из конфигурации, не из формы
     openai_api_base = Config.OPENAI_API_BASE or ''
     
@@ -368,13 +393,17 @@ def start_processing():
     if not (0 <= relevance_threshold <= 1):
         return jsonify({'error': 'Порог релевантности должен быть от 0.0 до 1.0'}), 400
     
+    from agents.summarizer import SUMMARY_MODES
+    if summary_mode not in SUMMARY_MODES:
+        return jsonify({'error': f"Режим саммари должен быть одним из: {', '.join(SUMMARY_MODES)}"}), 400
+    
     # Создание задачи
     task_id = str(uuid.uuid4())
     tracker = ProgressTracker(task_id)
     tasks_status[task_id] = tracker
     
     # Запуск обработки в отдельном потоке с настройками
-    thread = Thread(target=process_news_with_progress, args=(task_id, feed_urls, criteria, llm_model, llm_temperature, similarity_threshold, relevance_threshold, openai_api_base))
+    thread = Thread(target=process_news_with_progress, args=(task_id, feed_urls, criteria, llm_model, llm_temperature, similarity_threshold, relevance_threshold, openai_api_base, summary_mode))
     thread.daemon = True
     thread.start()
     
@@ -570,6 +599,8 @@ def delete_search_history(history_id):
         # Удаление истории (статьи удалятся каскадно благодаря cascade)
         session.delete(search_history)
         session.commit()
+        # Удаленные статьи должны собраться заново, поэтому кеш загрузки каналов больше не актуален
+        reset_feed_cache()
         
         return jsonify({
             'success': True,
@@ -845,6 +876,7 @@ def clear_database():
     session = None
     try:
         from sqlalchemy import inspect
+        from agents.fingerprint_store import delete_all_fingerprints
         
         # Проверка существования таблицы
         inspector = inspect(engine)
@@ -861,8 +893,14 @@ def clear_database():
         
         # Удаление всех статей
         if count > 0:
+            # Массовое удаление идет в обход ORM каскада, поэтому отпечатки удаляем явно
+            delete_all_fingerprints(session)
             session.query(NewsArticle).delete()
-            session.commit()
+            session.query(DuplicateCluster).delete()
+        session.query(ClassificationCache).delete()
+        session.query(SummaryCache).delete()
+        session.commit()
+        reset_feed_cache()
         
         return jsonify({
             'success': True,
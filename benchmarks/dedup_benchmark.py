@@ -0,0 +1,87 @@
+"""Бенчмарк сравнения пар статей при дедупликации
+
+Генерирует синтетические статьи (группы похожих заголовков и случайные
+заголовки), сравнивает все пары правилом дубликата на 1, 4 и 16 процессах
+и выводит скорость в парах в секунду. Дополнительно проверяет, что результат
+не зависит от количества процессов и совпадает с полным SequenceMatcher.ratio()
+без предварительных оценок.
+
+Запуск из корня проекта:
+    python benchmarks/dedup_benchmark.py --articles 1500 --workers 1,4,16
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.deduplicator import compare_pairs, calculate_similarity  # noqa: E402
+
+WORDS = (
+    'openai google model release new ai update startup funding chip market data cloud '
+    'security research robot agent search open source launch report growth deal court '
+    'privacy energy battery space network mobile browser platform developer tool'
+).split()
+
+
+def make_texts(count: int, seed: int = 1) -> list:
+    """Синтетические статьи (заголовок, содержимое): около трети - вариации других заголовков"""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        if texts and rng.random() < 0.3:
+            title, content = rng.choice(texts)
+            words = title.split()
+            words[rng.randrange(len(words))] = rng.choice(WORDS)
+            texts.append((' '.join(words), content))
+        else:
+            title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 12)))
+            content = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(30, 80)))
+            texts.append((title, content))
+    return texts
+
+
+def baseline_rule(texts: list, pairs: list, threshold: float) -> list:
+    """Правило дубликата через полный ratio() без предварительных оценок"""
+    results = []
+    for i, j in pairs:
+        title_sim = calculate_similarity(texts[i][0], texts[j][0])
+        content_sim = calculate_similarity(texts[i][1], texts[j][1])
+        results.append(title_sim >= threshold or (title_sim >= 0.7 and content_sim >= threshold))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--articles', type=int, default=1500, help='количество статей (пар - n*(n-1)/2)')
+    parser.add_argument('--workers', default='1,4,16', help='количества процессов через запятую')
+    parser.add_argument('--threshold', type=float, default=0.85, help='порог схожести')
+    parser.add_argument('--skip-baseline', action='store_true', help='не запускать сравнение без оценок')
+    args = parser.parse_args()
+    
+    texts = make_texts(args.articles)
+    pairs = [(i, j) for i in range(len(texts)) for j in range(i + 1, len(texts))]
+    print(f"Статей: {len(texts)}, пар: {len(pairs)}, порог: {args.threshold}, ядер CPU: {os.cpu_count()}")
+    
+    reference = None
+    if not args.skip_baseline:
+        started = time.perf_counter()
+        reference = baseline_rule(texts, pairs, args.threshold)
+        elapsed = time.perf_counter() - started
+        print(f"без оценок, 1 процесс: {elapsed:.2f} с, {len(pairs) / elapsed:,.0f} пар/с, дубликатов: {sum(reference)}")
+    
+    for workers in [int(value) for value in args.workers.split(',') if value.strip()]:
+        started = time.perf_counter()
+        results = compare_pairs(texts, pairs, args.threshold, workers)
+        elapsed = time.perf_counter() - started
+        if reference is None:
+            reference = results
+        status = 'совпадает' if results == reference else 'ОТЛИЧАЕТСЯ'
+        print(f"{workers} процесс(ов): {elapsed:.2f} с, {len(pairs) / elapsed:,.0f} пар/с, "
+              f"дубликатов: {sum(results)}, результат {status}")
+
+
+if __name__ == '__main__':
+    main()
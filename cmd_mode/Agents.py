@@ -2,13 +2,26 @@
 
 from typing import List
 
-from agents.rss_collector import collect_rss_news
+from agents.rss_collector import (
+    collect_rss_news,
+    save_articles,
+    save_feed_states,
+    summarize_feed_report,
+)
+from agents.feed_fetcher import FETCH_SUCCESS_STATUSES
 from agents.deduplicator import find_duplicates, mark_duplicates
+from agents.fingerprint_store import link_previous_articles
 from agents.classifier import classify_articles_with_settings
 from agents.summarizer import generate_summaries_for_articles
 from agents.embeddings import generate_embeddings_for_articles_by_ids
 from config import Config
-from models import NewsArticle, SearchHistory, get_db_session, init_db
+from models import (
+    NewsArticle,
+    SearchHistory,
+    get_db_session,
+    init_db,
+    update_search_history_results,
+)
 
 
 class NewsProcessingOrchestrator:
@@ -88,47 +101,37 @@ class NewsProcessingOrchestrator:
 
         # Шаг 1: Сбор новостей
         print("\n=== Шаг 1: Сбор новостей из RSS‑каналов ===")
-        articles = collect_rss_news(feed_urls)
+        feed_report: list = []
+        feed_states: list = []
+        articles = collect_rss_news(
+            feed_urls, feed_report=feed_report, feed_states=feed_states
+        )
+        feed_statuses = summarize_feed_report(feed_report)
+        update_search_history_results(
+            search_history_id,
+            {"feeds": feed_report, "feed_statuses": feed_statuses},
+        )
+        for entry in feed_report:
+            if entry["status"] not in FETCH_SUCCESS_STATUSES:
+                print(f"Канал {entry['url']}: {entry['status']} ({entry['error']})")
 
         if articles:
             print(f"Собрано {len(articles)} новых статей")
 
-            # Сохранение статей в БД
-            session = get_db_session()
+            # Сохранение статей в БД (многострочный INSERT с пропуском конфликтов)
             try:
-                saved_count = 0
-                for article in articles:
-                    # Проверяем, не существует ли уже эта статья в текущем запросе
-                    if search_history_id:
-                        existing = (
-                            session.query(NewsArticle)
-                            .filter(
-                                NewsArticle.link == article.link,
-                                NewsArticle.search_history_id == search_history_id,
-                            )
-                            .first()
-                        )
-
-                        if existing:
-                            continue  # Пропускаем, если уже есть в этом запросе
-
-                        article.search_history_id = search_history_id
-
-                    session.add(article)
-                    saved_count += 1
-
-                session.commit()
+                saved_ids = save_articles(articles, search_history_id)
                 print(
-                    f"Сохранено {saved_count} новых статей "
+                    f"Сохранено {len(saved_ids)} новых статей "
                     f"(из {len(articles)} собранных)"
                 )
             except Exception as e:  # noqa: BLE001
-                session.rollback()
+                # Кеш каналов не сохраняем - статьи будут собраны при следующем запуске
                 print(f"Ошибка при сохранении статей: {e}")
-            finally:
-                session.close()
+                feed_states = []
         else:
             print("Новых новостей не найдено")
+        save_feed_states(feed_states)
 
         # Получение необработанных статей для текущего запроса
         session = get_db_session()
@@ -172,6 +175,18 @@ class NewsProcessingOrchestrator:
         else:
             print("Дубликаты не найдены")
 
+        # Связывание с похожими статьями прошлых запросов
+        reuse_stats = link_previous_articles(
+            search_history_id, criteria, relevance_threshold, similarity_threshold
+        )
+        reused_article_ids = reuse_stats.pop("article_ids")
+        update_search_history_results(search_history_id, {"reused": reuse_stats})
+        if reuse_stats["matched"]:
+            print(
+                f"Найдено в прошлых запросах: {reuse_stats['matched']} "
+                f"(переиспользовано оценок: {reuse_stats['reused_scores']})"
+            )
+        
         # Получение уникальных статей для классификации
         session = get_db_session()
         try:
@@ -201,9 +216,22 @@ class NewsProcessingOrchestrator:
 
         # Шаг 3: Классификация
         print(f"\n=== Шаг 3: Классификация {len(unique_articles)} уникальных статей ===")
-        classify_articles_with_settings(
-            unique_articles, criteria, llm_model, llm_temperature, relevance_threshold
+        # Статьи не из кэша, далекие от критерия по embeddings, не отправляются в LLM
+        classification_stats = classify_articles_with_settings(
+            unique_articles,
+            criteria,
+            llm_model,
+            llm_temperature,
+            relevance_threshold,
+            with_summary=Config.SUMMARY_MODE == "combined",
+            search_history_id=search_history_id,
+        )
+        prefilter_skipped = classification_stats["prefilter_skipped"]
+        update_search_history_results(
+            search_history_id, {"prefilter_skipped": prefilter_skipped}
         )
+        if prefilter_skipped:
+            print(f"Отсеяно предварительным фильтром без LLM: {prefilter_skipped}")
         print(f"Классифицировано {len(unique_articles)} статей")
 
         # Шаг 4: Генерация саммари для релевантных статей
@@ -255,7 +283,9 @@ class NewsProcessingOrchestrator:
                 "\n=== Шаг 5: Генерация векторных представлений "
                 f"для {len(unique_article_ids)} статей ==="
             )
-            generate_embeddings_for_articles_by_ids(unique_article_ids, search_history_id)
+            generate_embeddings_for_articles_by_ids(
+                unique_article_ids + reused_article_ids, search_history_id
+            )
             print(f"Векторные представления сгенерированы для {len(unique_articles)} статей")
         except Exception as e:  # noqa: BLE001
             print(f"Ошибка при генерации embeddings: {e}")
@@ -316,6 +346,7 @@ class NewsProcessingOrchestrator:
                 )
                 if search_history:
                     search_history.results_data = {
+                        **(search_history.results_data or {}),
                         "total": total,
                         "relevant": relevant,
                         "duplicates": duplicates_count,
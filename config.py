@@ -23,14 +23,89 @@ class Config:
     # RSS каналы (разделенные запятыми)
     RSS_FEEDS = os.getenv('RSS_FEEDS', '').split(',') if os.getenv('RSS_FEEDS') else []
     
+    # Параллельный сбор RSS: общий лимит потоков и лимит одновременных запросов к одному хосту
+    RSS_FETCH_MAX_WORKERS = int(os.getenv('RSS_FETCH_MAX_WORKERS', '8'))
+    RSS_FETCH_PER_HOST_LIMIT = int(os.getenv('RSS_FETCH_PER_HOST_LIMIT', '2'))
+    
+    # Ограничения загрузки одного RSS канала: таймауты (секунды) и максимальный размер ответа (байты)
+    RSS_FETCH_CONNECT_TIMEOUT = float(os.getenv('RSS_FETCH_CONNECT_TIMEOUT', '5'))
+    RSS_FETCH_READ_TIMEOUT = float(os.getenv('RSS_FETCH_READ_TIMEOUT', '15'))
+    RSS_FETCH_TOTAL_TIMEOUT = float(os.getenv('RSS_FETCH_TOTAL_TIMEOUT', '30'))
+    RSS_FETCH_MAX_BYTES = int(os.getenv('RSS_FETCH_MAX_BYTES', str(5 * 1024 * 1024)))
+    
+    # Запас (часы) для водяного знака канала: записи старше последней даты публикации минус запас пропускаются
+    RSS_WATERMARK_SAFETY_HOURS = float(os.getenv('RSS_WATERMARK_SAFETY_HOURS', '24'))
+    
+    # Нормализация ссылок на статьи (каноническая ссылка для проверки существования и дубликатов)
+    LINK_TRACKING_PARAMS = [
+        param.strip() for param in os.getenv(
+            'LINK_TRACKING_PARAMS',
+            'utm_*,fbclid,gclid,yclid,dclid,msclkid,mc_cid,mc_eid,igshid,_hsenc,_hsmi,ref_src'
+        ).split(',') if param.strip()
+    ]
+    LINK_FORCE_HTTPS = os.getenv('LINK_FORCE_HTTPS', 'True').lower() == 'true'
+    LINK_STRIP_WWW = os.getenv('LINK_STRIP_WWW', 'True').lower() == 'true'
+    LINK_STRIP_AMP = os.getenv('LINK_STRIP_AMP', 'True').lower() == 'true'
+    LINK_STRIP_TRAILING_SLASH = os.getenv('LINK_STRIP_TRAILING_SLASH', 'True').lower() == 'true'
+    
     # Критерий отбора новостей
     SELECTION_CRITERIA = os.getenv('SELECTION_CRITERIA', '')
     
     # Настройки дедупликации
     SIMILARITY_THRESHOLD = float(os.getenv('SIMILARITY_THRESHOLD', '0.85'))
+    # Метод отбора пар для сравнения: minhash (LSH индекс по заголовкам), exact (все пары)
+    # или embedding (minhash и дополнительно косинусное сходство embeddings статей)
+    DEDUP_METHOD = os.getenv('DEDUP_METHOD', 'minhash').lower()
+    # Режим embedding: порог косинусного сходства и количество строк в блоке матрицы сходства
+    DEDUP_EMBEDDING_THRESHOLD = float(os.getenv('DEDUP_EMBEDDING_THRESHOLD', '0.92'))
+    DEDUP_EMBEDDING_BLOCK_SIZE = int(os.getenv('DEDUP_EMBEDDING_BLOCK_SIZE', '1024'))
+    # Параметры LSH: количество полос и значений в полосе (длина сигнатуры = полосы * значения)
+    DEDUP_LSH_BANDS = int(os.getenv('DEDUP_LSH_BANDS', '40'))
+    DEDUP_LSH_ROWS = int(os.getenv('DEDUP_LSH_ROWS', '3'))
+    # Количество процессов для сравнения текстов пар-кандидатов (1 - без пула процессов)
+    DEDUP_WORKERS = int(os.getenv('DEDUP_WORKERS', '1'))
     
     # Настройки релевантности
     RELEVANCE_THRESHOLD = float(os.getenv('RELEVANCE_THRESHOLD', '0.6'))
+    # Количество статей в одном запросе классификации к LLM (1 - по одной статье)
+    CLASSIFICATION_BATCH_SIZE = int(os.getenv('CLASSIFICATION_BATCH_SIZE', '10'))
+    # Максимальное количество одновременных запросов классификации к LLM
+    CLASSIFICATION_CONCURRENCY = int(os.getenv('CLASSIFICATION_CONCURRENCY', '4'))
+    # Ограничение длины ответа классификации на одну статью (токенов)
+    CLASSIFICATION_MAX_TOKENS = int(os.getenv('CLASSIFICATION_MAX_TOKENS', '200'))
+    # Длина текста статьи (символов, без HTML) в промпте классификации с саммари (режим combined)
+    CLASSIFICATION_COMBINED_CONTENT_LENGTH = int(os.getenv('CLASSIFICATION_COMBINED_CONTENT_LENGTH', '500'))
+    # JSON режим ответа LLM для классификации: auto (определяется для каждого endpoint), on, off
+    LLM_STRUCTURED_OUTPUT = os.getenv('LLM_STRUCTURED_OUTPUT', 'auto').lower()
+    # Прекращать чтение потокового JSON ответа сразу после закрытия объекта (соединение не возвращается в пул)
+    LLM_STREAM_EARLY_STOP = os.getenv('LLM_STREAM_EARLY_STOP', 'False').lower() == 'true'
+    # Минимальное косинусное сходство embeddings статьи и критерия отбора для отправки статьи в LLM
+    # (статьи ниже порога считаются нерелевантными без LLM; 0 - предварительный фильтр отключен)
+    PREFILTER_MIN_SIMILARITY = float(os.getenv('PREFILTER_MIN_SIMILARITY', '0'))
+    # Кэш результатов LLM классификации по (content_hash, критерий, модель, temperature, версия промпта)
+    CLASSIFICATION_CACHE_ENABLED = os.getenv('CLASSIFICATION_CACHE_ENABLED', 'True').lower() == 'true'
+    
+    # Режим саммари: llm (через LLM), extractive (локальный TextRank без LLM)
+    # или combined (саммари в том же запросе LLM, что и классификация)
+    SUMMARY_MODE = os.getenv('SUMMARY_MODE', 'llm').lower()
+    # Количество предложений в экстрактивном саммари
+    SUMMARY_EXTRACTIVE_SENTENCES = int(os.getenv('SUMMARY_EXTRACTIVE_SENTENCES', '3'))
+    # Максимальное количество одновременных запросов генерации саммари к LLM
+    SUMMARY_CONCURRENCY = int(os.getenv('SUMMARY_CONCURRENCY', '4'))
+    # Кэш саммари LLM по (content_hash, модель, версия промпта)
+    SUMMARY_CACHE_ENABLED = os.getenv('SUMMARY_CACHE_ENABLED', 'True').lower() == 'true'
+    
+    # Максимальное количество keep-alive соединений с одним хостом LLM / embeddings API
+    LLM_HTTP_POOL_SIZE = int(os.getenv('LLM_HTTP_POOL_SIZE', '16'))
+    
+    # Ограничение частоты запросов на пару (endpoint, модель): запросов и токенов в минуту (0 - без ограничения)
+    LLM_RATE_LIMIT_RPM = int(os.getenv('LLM_RATE_LIMIT_RPM', '0'))
+    LLM_RATE_LIMIT_TPM = int(os.getenv('LLM_RATE_LIMIT_TPM', '0'))
+    EMBEDDING_RATE_LIMIT_RPM = int(os.getenv('EMBEDDING_RATE_LIMIT_RPM', '0'))
+    EMBEDDING_RATE_LIMIT_TPM = int(os.getenv('EMBEDDING_RATE_LIMIT_TPM', '0'))
+    # Повторы запроса после ответа 429 и максимальное ожидание перед повтором (секунды)
+    LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '5'))
+    LLM_RETRY_MAX_WAIT = float(os.getenv('LLM_RETRY_MAX_WAIT', '60'))
     
     # Flask настройки
     FLASK_SECRET_KEY = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key-change-in-production')
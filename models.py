@@ -1,6 +1,6 @@
 """Модели базы данных для новостей и RSS каналов"""
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float, Boolean, ForeignKey, JSON, UniqueConstraint, LargeBinary
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float, Boolean, ForeignKey, JSON, UniqueConstraint, LargeBinary, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from config import Config
@@ -19,6 +19,16 @@ class RSSFeed(Base):
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Кеш условных запросов (ETag / Last-Modified) и хеш последнего загруженного тела
+    etag = Column(String(500), nullable=True)
+    last_modified = Column(String(100), nullable=True)
+    body_hash = Column(String(64), nullable=True)
+    last_fetched_at = Column(DateTime, nullable=True)
+    
+    # Водяной знак: самая поздняя дата публикации и GUID записей без даты последнего опроса
+    last_published_at = Column(DateTime, nullable=True)
+    seen_guids = Column(JSON, nullable=True)
 
 
 class SearchHistory(Base):
@@ -43,6 +53,7 @@ class SearchHistory(Base):
     
     # Связь с статьями
     articles = relationship("NewsArticle", back_populates="search_history", cascade="all, delete-orphan")
+    duplicate_clusters = relationship("DuplicateCluster", cascade="all, delete-orphan")
 
 
 class SystemSettings(Base):
@@ -68,6 +79,7 @@ class NewsArticle(Base):
     title = Column(String(500), nullable=False)
     content = Column(Text)
     link = Column(String(1000), nullable=False, index=True)
+    canonical_link = Column(String(1000), nullable=True, index=True)  # Ссылка без utm-меток, AMP и т.п.
     source = Column(String(200))
     published_at = Column(DateTime)
     collected_at = Column(DateTime, default=datetime.utcnow)
@@ -79,6 +91,7 @@ class NewsArticle(Base):
     # Результаты обработки
     is_duplicate = Column(Boolean, default=False)
     duplicate_of = Column(Integer, nullable=True)  # ID оригинальной статьи
+    cluster_id = Column(Integer, ForeignKey('duplicate_clusters.id'), nullable=True, index=True)  # Кластер дубликатов
     relevance_score = Column(Float, nullable=True)  # Оценка релевантности (0-1)
     is_relevant = Column(Boolean, default=False)
     classification_reason = Column(Text)  # Причина классификации
@@ -92,6 +105,81 @@ class NewsArticle(Base):
     # Векторное представление для семантического поиска (JSON массив чисел)
     embedding = Column(JSON, nullable=True)  # Embedding вектор статьи
 
+    # ID похожей статьи прошлого запроса, результаты которой переиспользованы
+    reused_from = Column(Integer, nullable=True)
+    
+    # Отпечаток заголовка для поиска похожих статей между запросами
+    fingerprint = relationship("ArticleFingerprint", uselist=False, cascade="all, delete-orphan")
+    fingerprint_bands = relationship("ArticleFingerprintBand", cascade="all, delete-orphan")
+
+
+class DuplicateCluster(Base):
+    """Кластер дубликатов: оригинал и все статьи, помеченные его дубликатами"""
+    __tablename__ = 'duplicate_clusters'
+    
+    id = Column(Integer, primary_key=True)
+    canonical_article_id = Column(Integer, nullable=False, index=True)  # ID оригинала кластера
+    search_history_id = Column(Integer, ForeignKey('search_history.id'), nullable=True, index=True)
+    size = Column(Integer, nullable=False, default=1)  # Количество статей вместе с оригиналом
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ArticleFingerprint(Base):
+    """MinHash сигнатура заголовка статьи"""
+    __tablename__ = 'article_fingerprints'
+    
+    article_id = Column(Integer, ForeignKey('news_articles.id'), primary_key=True)
+    signature = Column(LargeBinary, nullable=False)  # uint64 значения сигнатуры
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ArticleFingerprintBand(Base):
+    """Корзина LSH полосы сигнатуры (поиск похожих статей по индексу (band, bucket))"""
+    __tablename__ = 'article_fingerprint_bands'
+    __table_args__ = (
+        Index('ix_fingerprint_band_bucket', 'band', 'bucket'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    article_id = Column(Integer, ForeignKey('news_articles.id'), nullable=False, index=True)
+    band = Column(Integer, nullable=False)
+    bucket = Column(String(128), nullable=False)  # Значения полосы в hex
+
+
+class SummaryCache(Base):
+    """Саммари текста статьи, полученное от LLM (переиспользуется между запросами)"""
+    __tablename__ = 'summary_cache'
+    __table_args__ = (
+        UniqueConstraint('content_hash', 'llm_model', 'prompt_version', name='uq_summary_cache_key'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    content_hash = Column(String(64), nullable=False)  # content_hash статьи
+    llm_model = Column(String(100), nullable=False)
+    prompt_version = Column(String(20), nullable=False)
+    summary = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ClassificationCache(Base):
+    """Результат LLM классификации текста статьи по критерию (переиспользуется между запросами)"""
+    __tablename__ = 'classification_cache'
+    __table_args__ = (
+        UniqueConstraint('content_hash', 'criteria_hash', 'llm_model', 'llm_temperature', 'prompt_version',
+                         name='uq_classification_cache_key'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    content_hash = Column(String(64), nullable=False)  # content_hash статьи
+    criteria_hash = Column(String(64), nullable=False)  # SHA-256 нормализованного критерия отбора
+    llm_model = Column(String(100), nullable=False)
+    llm_temperature = Column(Float, nullable=False)
+    prompt_version = Column(String(20), nullable=False)
+    relevance_score = Column(Float, nullable=False)
+    classification_reason = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 
 # Создание движка БД и сессии
 # Убеждаемся, что директория data существует
@@ -129,6 +217,39 @@ def init_db():
         print("Настройки можно инициализировать вручную через UI")
     
     # Для SQLite: добавляем недостающие колонки, если таблица уже существует
+    _migrate_sqlite_columns()
+    # Статьи, собранные до появления canonical_link
+    _backfill_canonical_links()
+
+
+def _backfill_canonical_links():
+    """Заполнение canonical_link статей, собранных до появления колонки
+    
+    Без нее проверка существования по канонической ссылке не находит старые статьи.
+    """
+    from agents.link_canonicalizer import canonicalize_link
+    from agents.db_utils import iter_chunks, update_by_id
+    
+    session = get_db_session()
+    try:
+        rows = session.query(NewsArticle.id, NewsArticle.link).filter(NewsArticle.canonical_link == None).all()
+        if not rows:
+            return
+        for chunk in iter_chunks(rows):
+            update_by_id(session, NewsArticle, [
+                {'id': article_id, 'canonical_link': canonicalize_link(link)} for article_id, link in chunk
+            ])
+        session.commit()
+        print(f"Заполнена каноническая ссылка для {len(rows)} статей")
+    except Exception as e:
+        session.rollback()
+        print(f"Ошибка при заполнении канонических ссылок: {e}")
+    finally:
+        session.close()
+
+
+def _migrate_sqlite_columns():
+    """Добавление недостающих колонок SQLite, если таблицы уже существуют"""
     if Config.DATABASE_URL.startswith('sqlite:///'):
         from sqlalchemy import text
         try:
@@ -170,10 +291,45 @@ def init_db():
                             print("Добавлена колонка embedding в таблицу news_articles")
                         except Exception as e:
                             print(f"Ошибка при добавлении колонки embedding: {e}")
+                
+                _add_missing_sqlite_columns(conn, 'news_articles', {
+                    'canonical_link': 'VARCHAR(1000)',
+                    'reused_from': 'INTEGER',
+                    'cluster_id': 'INTEGER'
+                })
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_news_articles_canonical_link ON news_articles (canonical_link)"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_news_articles_cluster_id ON news_articles (cluster_id)"))
+                
+                _add_missing_sqlite_columns(conn, 'rss_feeds', {
+                    'etag': 'VARCHAR(500)',
+                    'last_modified': 'VARCHAR(100)',
+                    'body_hash': 'VARCHAR(64)',
+                    'last_fetched_at': 'DATETIME',
+                    'last_published_at': 'DATETIME',
+                    'seen_guids': 'JSON'
+                })
         except Exception as e:
             print(f"Ошибка при проверке/обновлении схемы БД: {e}")
 
 
+def _add_missing_sqlite_columns(conn, table_name: str, columns: dict):
+    """Добавление недостающих колонок в существующую таблицу SQLite"""
+    from sqlalchemy import text
+    result = conn.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name=:name"), {'name': table_name})
+    if not result.fetchone():
+        return  # Таблица будет создана целиком через create_all
+    
+    existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info('{table_name}')"))}
+    for column_name, column_type in columns.items():
+        if column_name in existing:
+            continue
+        try:
+            conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"))
+            print(f"Добавлена колонка {column_name} в таблицу {table_name}")
+        except Exception as e:
+            print(f"Ошибка при добавлении колонки {column_name}: {e}")
+
+
 def init_default_settings():
     """Инициализация настроек по умолчанию (только если таблица пустая)"""
     session = get_db_session()
@@ -349,6 +505,43 @@ def get_all_settings(category: str = None):
         session.close()
 
 
+def update_search_history_results(search_history_id: int, values: dict):
+    """Дополнение results_data истории запроса (существующие ключи сохраняются)"""
+    if not search_history_id:
+        return
+    session = get_db_session()
+    try:
+        search_history = session.query(SearchHistory).filter_by(id=search_history_id).first()
+        if search_history:
+            # JSON колонка не отслеживает изменения на месте, поэтому присваиваем новый словарь
+            search_history.results_data = {**(search_history.results_data or {}), **values}
+            session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"Ошибка при обновлении результатов истории запроса {search_history_id}: {e}")
+    finally:
+        session.close()
+
+
+def reset_feed_cache():
+    """Сброс кеша загрузки RSS каналов (после удаления статей их нужно собрать заново)"""
+    session = get_db_session()
+    try:
+        session.query(RSSFeed).update({
+            RSSFeed.etag: None,
+            RSSFeed.last_modified: None,
+            RSSFeed.body_hash: None,
+            RSSFeed.last_published_at: None,
+            RSSFeed.seen_guids: None
+        }, synchronize_session=False)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"Ошибка при сбросе кеша RSS каналов: {e}")
+    finally:
+        session.close()
+
+
 def get_db_session():
     """Получение сессии БД"""
     return SessionLocal()
@@ -33,6 +33,7 @@ document.addEventListener('DOMContentLoaded', function() {
             const llmTemperature = parseFloat(document.getElementById('llm_temperature').value);
             const similarityThreshold = parseFloat(document.getElementById('similarity_threshold').value);
             const relevanceThreshold = parseFloat(document.getElementById('relevance_threshold').value);
+            const summaryMode = document.getElementById('summary_mode').value;
 
             if (!rssFeeds.trim() || !criteria.trim()) {
                 alert('Заполните обязательные поля: RSS каналы и критерий отбора');
@@ -70,7 +71,8 @@ document.addEventListener('DOMContentLoaded', function() {
                         llm_model: llmModel,
                         llm_temperature: llmTemperature,
                         similarity_threshold: similarityThreshold,
-                        relevance_threshold: relevanceThreshold
+                        relevance_threshold: relevanceThreshold,
+                        summary_mode: summaryMode
                     })
                 });
 
@@ -0,0 +1,5 @@
+"""Общая настройка тестов: отдельная временная БД SQLite вместо рабочей"""
+import os
+import tempfile
+
+os.environ['DATABASE_URL'] = f"sqlite:///{tempfile.mkdtemp()}/test.db"
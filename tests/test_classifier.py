@@ -0,0 +1,26 @@
+"""Разбор ответов LLM классификации"""
+import pytest
+
+pytest.importorskip('langchain_openai')
+
+from agents.classifier import _parse_batch_response, _parse_single_response
+
+
+def test_single_response_relevance_follows_threshold():
+    result = _parse_single_response('{"relevance_score": 0.8, "is_relevant": false, "summary": "Саммари"}', 0.7)
+    assert result['is_relevant'] is True
+    assert result['summary'] == 'Саммари'
+    
+    result = _parse_single_response('{"relevance_score": 0.5, "is_relevant": true, "summary": "Саммари"}', 0.7)
+    assert result['is_relevant'] is False
+    assert 'summary' not in result
+
+
+def test_batch_response_relevance_follows_threshold():
+    results = _parse_batch_response(
+        '{"results": [{"id": 1, "relevance_score": 0.9, "is_relevant": false},'
+        ' {"id": 2, "relevance_score": 0.1, "is_relevant": true}]}',
+        0.7
+    )
+    assert results[1]['is_relevant'] is True
+    assert results[2]['is_relevant'] is False
@@ -0,0 +1,30 @@
+"""Пакетные операции с БД"""
+from agents.db_utils import update_by_id
+from models import NewsArticle, get_db_session, init_db
+
+
+def test_update_by_id():
+    init_db()
+    session = get_db_session()
+    try:
+        session.query(NewsArticle).delete()
+        articles = [NewsArticle(title=f'Новость {number}', link=f'https://example.com/{number}') for number in range(3)]
+        session.add_all(articles)
+        session.commit()
+        ids = [article.id for article in articles]
+        
+        update_by_id(session, NewsArticle, [
+            {'id': ids[0], 'summary': 'Первая', 'duplicate_of': None},
+            {'id': ids[1], 'summary': 'Вторая', 'duplicate_of': ids[0]},
+            {'id': ids[2] + 100, 'summary': 'Удаленная', 'duplicate_of': None}
+        ], is_duplicate=True)
+        update_by_id(session, NewsArticle, [])
+        session.commit()
+        session.expire_all()
+        
+        rows = {article.id: article for article in session.query(NewsArticle).all()}
+        assert (rows[ids[0]].summary, rows[ids[0]].duplicate_of, rows[ids[0]].is_duplicate) == ('Первая', None, True)
+        assert (rows[ids[1]].summary, rows[ids[1]].duplicate_of, rows[ids[1]].is_duplicate) == ('Вторая', ids[0], True)
+        assert (rows[ids[2]].summary, rows[ids[2]].is_duplicate) == (None, False)
+    finally:
+        session.close()
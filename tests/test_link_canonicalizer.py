@@ -0,0 +1,54 @@
+"""Каноническая форма ссылок на статьи"""
+import pytest
+
+from agents.link_canonicalizer import canonicalize_link
+
+RULES = {
+    'tracking_params': ['utm_*', 'fbclid'],
+    'force_https': True,
+    'strip_www': True,
+    'strip_amp': True,
+    'strip_trailing_slash': True
+}
+
+
+@pytest.mark.parametrize('link, expected', [
+    ('http://www.Example.com/news/story/?utm_source=rss&b=2&a=1#top', 'https://example.com/news/story?a=1&b=2'),
+    ('https://example.com/news/story/amp', 'https://example.com/news/story'),
+    ('https://example.com/news/story/amp/', 'https://example.com/news/story'),
+    ('https://example.com/amp/news/story', 'https://example.com/news/story'),
+    ('https://example.com/news/story.amp.html', 'https://example.com/news/story.html'),
+    ('https://amp.example.com/news/story?amp=1', 'https://example.com/news/story'),
+])
+def test_canonicalize_link(link, expected):
+    assert canonicalize_link(link, RULES) == expected
+
+
+@pytest.mark.parametrize('link, expected', [
+    ('https://example.com/tags/amp/page2', 'https://example.com/tags/amp/page2'),
+    ('https://example.com/amp/x/amp/y', 'https://example.com/x/amp/y'),
+    ('https://example.com/news/amplifier', 'https://example.com/news/amplifier'),
+])
+def test_mid_path_amp_segments_are_kept(link, expected):
+    assert canonicalize_link(link, RULES) == expected
+
+
+def test_mid_path_amp_does_not_collide():
+    assert canonicalize_link('https://example.com/a/amp/b', RULES) != canonicalize_link('https://example.com/a/b', RULES)
+
+
+@pytest.mark.parametrize('link, expected', [
+    ('http://example.com:80/a', 'https://example.com/a'),
+    ('https://example.com:443/a', 'https://example.com/a'),
+    ('http://example.com:8080/a', 'https://example.com:8080/a'),
+])
+def test_default_port_of_original_scheme_is_dropped(link, expected):
+    assert canonicalize_link(link, RULES) == expected
+
+
+@pytest.mark.parametrize('link, expected', [
+    ('http://[::1]:8080/x', 'https://[::1]:8080/x'),
+    ('http://[2001:DB8::1]/x', 'https://[2001:db8::1]/x'),
+])
+def test_ipv6_host_keeps_brackets(link, expected):
+    assert canonicalize_link(link, RULES) == expected
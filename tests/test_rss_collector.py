@@ -0,0 +1,98 @@
+"""Сбор RSS каналов: водяной знак для записей без даты и массовое сохранение статей"""
+import feedparser
+import pytest
+from sqlalchemy import event
+
+import agents.rss_collector as rss_collector
+from agents.db_utils import MAX_SQL_PARAMETERS
+from agents.feed_fetcher import FETCH_OK
+from models import NewsArticle, RSSFeed, SearchHistory, engine, get_db_session, init_db
+
+FEED_URL = 'https://example.com/feed.xml'
+
+
+def make_feed(numbers: list) -> str:
+    """RSS канал с записями без даты в указанном порядке"""
+    items = ''.join(
+        f"<item><title>Новость {number}</title><link>https://example.com/news/{number}</link>"
+        f"<guid>news-{number}</guid><description>Текст {number}</description></item>"
+        for number in numbers
+    )
+    return f'<?xml version="1.0"?><rss version="2.0"><channel><title>Тест</title>{items}</channel></rss>'
+
+
+@pytest.fixture
+def db():
+    """Пустые таблицы статей и каналов во временной БД"""
+    init_db()
+    session = get_db_session()
+    session.query(NewsArticle).delete()
+    session.query(RSSFeed).delete()
+    session.commit()
+    session.close()
+
+
+@pytest.fixture
+def serve_feed(db, monkeypatch):
+    """Подмена загрузки канала: возвращает текущее содержимое current['body']"""
+    current = {}
+    
+    def fake_fetch_feed(feed_url, **validators):
+        return {'url': feed_url, 'status': FETCH_OK, 'feed': feedparser.parse(current['body']),
+                'error': '', 'etag': None, 'last_modified': None, 'body_hash': None}
+    
+    monkeypatch.setattr(rss_collector, 'fetch_feed', fake_fetch_feed)
+    return current
+
+
+def collect_titles() -> list:
+    """Сбор канала с сохранением водяного знака (статьи не сохраняются)"""
+    return [article.title for article in rss_collector.collect_rss_news([FEED_URL], max_workers=1)]
+
+
+def test_undated_oldest_first_feed(serve_feed):
+    serve_feed['body'] = make_feed([1, 2, 3])
+    assert collect_titles() == ['Новость 1', 'Новость 2', 'Новость 3']
+    
+    # Новые записи добавляются в конец канала
+    serve_feed['body'] = make_feed([1, 2, 3, 4, 5])
+    assert collect_titles() == ['Новость 4', 'Новость 5']
+    assert collect_titles() == []
+
+
+def test_undated_newest_first_feed(serve_feed):
+    serve_feed['body'] = make_feed([3, 2, 1])
+    assert collect_titles() == ['Новость 3', 'Новость 2', 'Новость 1']
+    
+    serve_feed['body'] = make_feed([5, 4, 3, 2])
+    assert collect_titles() == ['Новость 5', 'Новость 4']
+
+
+def test_save_articles_respects_parameter_limit(db):
+    session = get_db_session()
+    history = SearchHistory(rss_feeds=FEED_URL, selection_criteria='тест')
+    session.add(history)
+    session.commit()
+    search_history_id = history.id
+    session.close()
+    
+    articles = [
+        NewsArticle(title=f'Новость {number}', content='Текст', link=f'https://example.com/news/{number}',
+                    source='Тест', content_hash=f'hash-{number}')
+        for number in range(300)
+    ]
+    parameter_counts = []
+    
+    def count_parameters(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT INTO news_articles'):
+            parameter_counts.append(len(parameters))
+    
+    event.listen(engine, 'before_cursor_execute', count_parameters)
+    try:
+        saved_ids = rss_collector.save_articles(articles, search_history_id)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_parameters)
+    
+    assert len(saved_ids) == len(set(saved_ids)) == 300
+    assert len(parameter_counts) > 1
+    assert max(parameter_counts) <= MAX_SQL_PARAMETERS
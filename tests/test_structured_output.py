@@ -0,0 +1,86 @@
+"""Потоковый JSON ответ LLM: разбор и возврат соединения в пул keep-alive"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('langchain_openai')
+
+from config import Config
+from agents import structured_output
+from agents.structured_output import json_chat_completion, parse_json_value
+
+
+class _ChatHandler(BaseHTTPRequestHandler):
+    """OpenAI-совместимый chat completions: SSE поток с chunked передачей"""
+    protocol_version = 'HTTP/1.1'
+    client_ports = []
+    
+    def log_message(self, *args):
+        pass
+    
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+    
+    def do_POST(self):
+        self.client_ports.append(self.client_address[1])
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if not body.get('stream'):
+            content = json.dumps({'choices': [{'message': {'content': '{"score": 0.5}'}}]}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        # После закрытия объекта модель дописывает пробелы до max_tokens
+        for delta in ['{"score"', ': 0.9}', '   ', '\n\n']:
+            event = {'choices': [{'delta': {'content': delta}}]}
+            self._write_chunk(f'data: {json.dumps(event)}\n\n'.encode())
+        self._write_chunk(b'data: [DONE]\n\n')
+        self._write_chunk(b'')
+        self.wfile.flush()
+
+
+@pytest.fixture
+def chat_server(monkeypatch):
+    _ChatHandler.client_ports = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _ChatHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(Config, 'OPENAI_API_BASE', f'http://127.0.0.1:{server.server_port}/v1')
+    monkeypatch.setattr(Config, 'OPENAI_API_KEY', 'test')
+    monkeypatch.setattr(Config, 'LLM_RATE_LIMIT_RPM', 0)
+    monkeypatch.setattr(Config, 'LLM_RATE_LIMIT_TPM', 0)
+    monkeypatch.setattr(structured_output, '_support', {})
+    yield _ChatHandler
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('mode', ['on', 'off'])
+def test_json_completion_reuses_connection(chat_server, monkeypatch, mode):
+    monkeypatch.setattr(Config, 'LLM_STRUCTURED_OUTPUT', mode)
+    monkeypatch.setattr(Config, 'LLM_STREAM_EARLY_STOP', False)
+    for _ in range(6):
+        content = json_chat_completion('prompt', 'test-model', 0.0, 50)
+        assert parse_json_value(content)['score'] in (0.9, 0.5)
+    assert len(chat_server.client_ports) == 6
+    assert len(set(chat_server.client_ports)) == 1
+
+
+def test_stream_returns_first_json_object(chat_server, monkeypatch):
+    monkeypatch.setattr(Config, 'LLM_STRUCTURED_OUTPUT', 'on')
+    assert json_chat_completion('prompt', 'test-model', 0.0, 50) == '{"score": 0.9}'
+
+
+def test_early_stop_returns_same_object(chat_server, monkeypatch):
+    monkeypatch.setattr(Config, 'LLM_STRUCTURED_OUTPUT', 'on')
+    monkeypatch.setattr(Config, 'LLM_STREAM_EARLY_STOP', True)
+    assert json_chat_completion('prompt', 'test-model', 0.0, 50) == '{"score": 0.9}'